@@ -1,10 +1,19 @@
 import os
+import sys
+import atexit
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
 from logtail import LogtailHandler
 
-# 1. Load the .env file
-load_dotenv()
+# 1. Load the .env file (once per process)
+# importlib.reload() re-runs this module in the same namespace, so the
+# sentinel survives and we skip re-parsing .env on hot reloads.
+_DOTENV_LOADED = globals().get("_DOTENV_LOADED", False)
+if not _DOTENV_LOADED:
+    load_dotenv()
+    _DOTENV_LOADED = True
 
 # 2. Calculate the Project Root Directory
 # We are in: /app/core/config.py
@@ -12,43 +21,91 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 3. Setup Logging (Centralized)
+# Running QueueListeners, stopped (and drained) by stop_logging()
+_listeners = globals().get("_listeners", [])
+# Stopped ones; their QueueHandlers stay attached, so start_logging() resumes them
+_stopped_listeners = globals().get("_stopped_listeners", [])
+
+def make_queue_handler(*handlers):
+    """
+    Moves slow handlers (console, file, Logtail HTTP) onto a background thread.
+    Returns a QueueHandler for the logger: request code only pays for an
+    in-memory enqueue, the QueueListener thread does the actual writes.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    return QueueHandler(log_queue), listener
+
+def stop_logging():
+    """
+    Stops every queue listener after it has written out the records still queued.
+    Safe to call more than once: the app shutdown hook calls it, then atexit does.
+    """
+    while _listeners:
+        listener = _listeners.pop()
+        listener.stop()
+        _stopped_listeners.append(listener)
+
+def start_logging():
+    """
+    Restarts listeners stopped by stop_logging(). The loggers keep their
+    QueueHandlers across a shutdown, so without this a second app started in the
+    same process (tests, create_app()) would only fill queues nobody reads.
+    Records queued in between are written out once the listener is back.
+    """
+    while _stopped_listeners:
+        listener = _stopped_listeners.pop()
+        listener.start()
+        _listeners.append(listener)
+
+atexit.register(stop_logging)
+
 def setup_logging():
     # A. Create the Master Logger
     logger = logging.getLogger("PolyToPro")
     
     # Prevent duplicate logs (propagation)
     logger.propagate = False
-    
-    # Clear existing handlers to prevent doubles on reload
-    if logger.hasHandlers():
-        logger.handlers.clear()
+
+    # Already configured (uvicorn --reload, nested imports): reuse our handlers
+    # instead of stacking another Console/Logtail pair on every call.
+    if any(getattr(h, "_p2p", False) for h in logger.handlers):
+        return logger
         
     logger.setLevel(logging.INFO)
 
-    # B. Add Console Handler (Required for Render Logs)
+    # B. Console Handler (Required for Render Logs)
     stream_handler = logging.StreamHandler()
     formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
     stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
+    sinks = [stream_handler]
 
-    # C. Add Better Stack (Logtail) - Optional
+    # C. Better Stack (Logtail) - Optional
     logtail_token = os.getenv("LOGTAIL_SOURCE_TOKEN")
     
     if logtail_token:
         try:
-            handler = LogtailHandler(
+            sinks.append(LogtailHandler(
                 source_token=logtail_token,
-                host="https://s1693478.eu-nbg-2.betterstackdata.com")
-            logger.addHandler(handler)
-            # Use extra dict to prevent 'extra' keyword errors if simple string
-            logger.info(f"Better Stack API: {logtail_token}")
-            logger.info("✅ Better Stack Cloud Logging ENABLED")
+                host="https://s1693478.eu-nbg-2.betterstackdata.com"))
         except Exception as e:
-            # Fallback if connection fails
-            print(f"❌ Failed to connect to Better Stack: {e}")
+            # Fallback if connection fails (stderr directly; the logger isn't wired yet)
+            print(f"❌ Failed to connect to Better Stack: {e}", file=sys.stderr)
     else:
         # Just print to console if token is missing
-        print("⚠️ No LOGTAIL_SOURCE_TOKEN found. Logging to console only.")
+        print("⚠️ No LOGTAIL_SOURCE_TOKEN found. Logging to console only.", file=sys.stderr)
+
+    # D. Attach a single queue handler; the sinks run on the listener thread
+    queue_handler, _ = make_queue_handler(*sinks)
+    queue_handler._p2p = True
+    logger.addHandler(queue_handler)
+
+    if len(sinks) > 1:
+        # Local notice only: going through the logger would make a Logtail
+        # round trip on every worker start just to announce itself.
+        print("✅ Better Stack Cloud Logging ENABLED", file=sys.stderr)
 
     return logger
 
@@ -64,16 +121,61 @@ class Settings:
     STAR_GUIDE_PATH = os.path.join(BASE_DIR, "star_guide.pdf")
     EXCEL_PATH = os.path.join(BASE_DIR, "jobsandskills.xlsx")
     JSON_PATH = os.path.join(BASE_DIR, "questions.json")
+    # Plain-text copy of the STAR guide, reused while newer than the PDF
+    STAR_GUIDE_CACHE_PATH = STAR_GUIDE_PATH + ".cache.txt"
+
+    # Longest resume text the AI prompts use; extraction stops there
+    RESUME_MAX_CHARS = 10000
+    # Longest interview answer accepted by /analyze_stream
+    ANSWER_MAX_CHARS = 4000
+    # Role names and interview questions are short; the caps keep role-keyed
+    # caches and prompts from holding arbitrarily large client strings
+    ROLE_MAX_CHARS = 200
+    QUESTION_MAX_CHARS = 1000
+
+    # Env-backed values are snapshotted once into slots when the singleton is built
+    __slots__ = (
+        "API_SECRET",
+        "GOOGLE_API_KEY",
+        "OPENAI_API_KEY",
+        "GROQ_API_KEY",
+        "PINECONE_API_KEY",
+        "LOGTAIL_SOURCE_TOKEN",
+        "PINECONE_INDEX_NAME",
+        "DB_RELEASE_URL",
+        "THREAD_POOL_SIZE",
+        "STAR_GUIDE_TEXT_CACHE",
+        "RACE_TIER1",
+    )
+
+    def __init__(self):
+        env = os.environ
+
+        # --- API KEYS ---
+        self.API_SECRET = env.get("BACKEND_SECRET", "default-insecure-secret")
+        self.GOOGLE_API_KEY = env.get("GOOGLE_API_KEY")
+        self.OPENAI_API_KEY = env.get("OPENAI_API_KEY")
+        self.GROQ_API_KEY = env.get("GROQ_API_KEY")
+        self.PINECONE_API_KEY = env.get("PINECONE_API_KEY")
+        self.LOGTAIL_SOURCE_TOKEN = env.get("LOGTAIL_SOURCE_TOKEN")
+
+        # --- PINECONE CONFIG ---
+        self.PINECONE_INDEX_NAME = env.get("PINECONE_INDEX_NAME")
+
+        # --- PREBUILT DATABASE ---
+        # Optional URL of a skills.db built ahead of time; skips the Excel/JSON seeding
+        self.DB_RELEASE_URL = env.get("DB_RELEASE_URL")
 
-    # --- API KEYS ---
-    API_SECRET = os.getenv("BACKEND_SECRET", "default-insecure-secret")
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-    PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-    LOGTAIL_SOURCE_TOKEN = os.getenv("LOGTAIL_SOURCE_TOKEN")
+        # --- CONCURRENCY ---
+        # Workers for asyncio.to_thread (PDF parsing, guardrail calls, startup steps)
+        self.THREAD_POOL_SIZE = int(env.get("THREAD_POOL_SIZE") or min(32, (os.cpu_count() or 1) + 4))
+        # Call Gemini and OpenAI at once and keep the first answer (lower latency,
+        # roughly double the Tier 1 spend; the losing call still logs its token usage).
+        # Set RACE_TIER1=false to try them one by one.
+        self.RACE_TIER1 = env.get("RACE_TIER1", "true").lower() not in ("0", "false", "no")
 
-    # --- PINECONE CONFIG ---
-    PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
+        # --- STARTUP CACHES ---
+        # Set STAR_GUIDE_TEXT_CACHE=false to re-extract the STAR guide PDF on every boot
+        self.STAR_GUIDE_TEXT_CACHE = env.get("STAR_GUIDE_TEXT_CACHE", "true").lower() not in ("0", "false", "no")
 
 settings = Settings()
\ No newline at end of file
@@ -1,32 +1,104 @@
 # File: app/db/database.py
 import sqlite3
+import asyncio
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from pathlib import Path
+from typing import Final
 from app.core.config import settings
+from app.utils.cache import LRUCache
 
 # --- LOGGER SETUP ---
 logger = logging.getLogger(__name__)
 
 # --- CONFIGURATION ---
-# We use relative paths to find skills.db in the ROOT folder
-# File is in: app/db/database.py
-# .parent -> app/db/
-# .parent -> app/
-# .parent -> PROJECT_ROOT/
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(CURRENT_DIR)))
-DB_FILE = settings.DB_PATH
-
-# Fallback if the logic above fails in some envs, assume standard structure
-if not os.path.exists(DB_FILE):
-    # Try one level up (if running from root)
-    DB_FILE = settings.DB_PATH
+# Resolved once from settings (absolute path to skills.db in the project root)
+DB_FILE: Final[str] = os.fspath(settings.DB_PATH)
+
+# --- SQL ---
+# Kept as module constants so every call hands SQLite the identical string and
+# hits the connection's prepared-statement cache instead of re-preparing.
+_Q_QUESTIONS = "SELECT id, question_text FROM saved_questions ORDER BY id ASC"
+_Q_ROLES = "SELECT DISTINCT role FROM role_descriptions ORDER BY role ASC"
+
+# Description, tasks and competencies in a single statement,
+# each row tagged with its source ('D', 'T' or 'S')
+_Q_DETAILED_SKILLS = """
+    SELECT 
+        s.title, 
+        s.skill_code,
+        rs.proficiency,
+        substr(GROUP_CONCAT(d.detail_item, '; '), 1, 200) as knowledge_list
+    FROM role_skills rs 
+    JOIN skill_definitions s ON rs.skill_code = s.skill_code 
+    LEFT JOIN skill_details d ON s.skill_code = d.skill_code
+    WHERE rs.role = ? 
+    GROUP BY s.skill_code
+    LIMIT 6
+"""
+
+_Q_MATCH_SKILLS = """
+    SELECT 
+        COALESCE(s.title, rs.skill_title) as title, 
+        rs.skill_code, 
+        rs.proficiency,
+        substr(GROUP_CONCAT(d.detail_item, '; '), 1, 300) as knowledge_list
+    FROM role_skills rs 
+    LEFT JOIN skill_definitions s ON rs.skill_code = s.skill_code 
+    LEFT JOIN skill_details d ON rs.skill_code = d.skill_code
+    WHERE rs.role = ? 
+    GROUP BY rs.skill_code
+    LIMIT 8
+"""
+
+# Every helper here is a pure read; writes only happen in initialize.init_db().
+# Not opened with immutable=1 or cache=shared: init_db may rebuild the file while
+# the app is running, and shared-cache mode is deprecated by SQLite.
+DB_URI: Final[str] = Path(DB_FILE).as_uri() + "?mode=ro"
+
+# One connection per worker thread, reused across calls
+_local = threading.local()
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row # Access columns by name
+    """Returns this thread's cached read-only connection, opening (and tuning) it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_URI, uri=True, cached_statements=256)
+        conn.executescript("""
+            PRAGMA query_only=ON;
+            PRAGMA cache_size=-65536;
+            PRAGMA mmap_size=268435456;
+            PRAGMA temp_store=MEMORY;
+        """)
+        _local.conn = conn
     return conn
 
+# Dedicated pool for lookups made from async handlers, so they never queue behind
+# PDF parsing or other blocking work on the loop's default executor. Each worker
+# keeps its own connection via _local. Created on first use and dropped by
+# shutdown_db_pool(), so an app started after an earlier shutdown gets a fresh pool.
+_db_executor = None
+
+def _get_db_executor():
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="db")
+    return _db_executor
+
+def run_in_db_pool(func, *args):
+    """Runs a blocking database helper on the DB pool; await the returned future."""
+    return asyncio.get_running_loop().run_in_executor(_get_db_executor(), func, *args)
+
+def shutdown_db_pool():
+    """Stops the DB pool (pending lookups are cancelled); the next lookup starts a new one."""
+    global _db_executor
+    executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
 # --- MOVED FROM MAIN.PY ---
 
 def get_questions():
@@ -34,10 +106,8 @@ def get_questions():
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id, question_text FROM saved_questions ORDER BY id ASC")
-        rows = cursor.fetchall()
-        conn.close()
-        return [{"id": r["id"], "text": r["question_text"]} for r in rows]
+        cursor.execute(_Q_QUESTIONS)
+        return [{"id": q_id, "text": text} for q_id, text in cursor.fetchall()]
     except Exception as e:
         logger.error(f"Error fetching questions: {e}", exc_info=True)
         return []
@@ -47,139 +117,135 @@ def get_roles():
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT role FROM role_descriptions ORDER BY role ASC")
-        rows = cursor.fetchall()
-        conn.close()
-        return [row[0] for row in rows]
+        cursor.execute(_Q_ROLES)
+        return [role for (role,) in cursor.fetchall()]
     except Exception as e:
         logger.error(f"Error fetching roles: {e}", exc_info=True)
         return []
 
-def get_full_role_context(role: str) -> str:
-    """Fetches context for the Manager Agent."""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT description, expectations FROM role_descriptions WHERE role = ?", (role,))
-        desc_row = cursor.fetchone()
-        
-        if not desc_row:
-            conn.close()
-            return "No specific role data found. Use general best practices."
-
-        cursor.execute("SELECT task FROM role_tasks WHERE role = ? LIMIT 5", (role,))
-        tasks = [r[0] for r in cursor.fetchall()]
-        
-        query = """
-            SELECT s.title, s.description FROM role_skills rs 
-            JOIN skill_definitions s ON rs.skill_code = s.skill_code 
-            WHERE rs.role = ? LIMIT 10
-        """
-        cursor.execute(query, (role,))
-        skills = cursor.fetchall()
-        conn.close()
-
-        context = f"ROLE: {role}\nDESC: {desc_row[0]}\nEXPECTATIONS: {desc_row[1]}\nKEY TASKS:\n"
-        for t in tasks: context += f"- {t}\n"
-        context += "\nCOMPETENCIES:\n"
-        for t, d in skills: context += f"- {t}: {d}\n"
-        return context
-    except Exception as e:
-        logger.error(f"Error fetching role context: {e}")
-        return "Error loading context."
-
 def get_detailed_skills(role_name):
     """
     Fetches explicit metadata (Role, Skill Code, Proficiency, Knowledge) 
     to force the AI to cite sources precisely.
     """
+    cached = _detailed_skills_cache.get(role_name)
+    if cached is not None:
+        return cached
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        logger.info(f"Fetching detailed skills spec for: {role_name}")
-        query = """
-            SELECT 
-                s.title, 
-                s.skill_code,
-                rs.proficiency,
-                GROUP_CONCAT(d.detail_item, '; ') as knowledge_list
-            FROM role_skills rs 
-            JOIN skill_definitions s ON rs.skill_code = s.skill_code 
-            LEFT JOIN skill_details d ON s.skill_code = d.skill_code
-            WHERE rs.role = ? 
-            GROUP BY s.skill_code
-            LIMIT 6
-        """
-        cursor.execute(query, (role_name,))
-        rows = cursor.fetchall()
-        conn.close()
-        
-        if not rows:
-            return f"Standard industry spec for {role_name} (No specific DB entry)."
-
-        skills_text = f"OFFICIAL SPECIFICATION FOR ROLE: {role_name.upper()}\n"
-        skills_text += "=" * 40 + "\n\n"
-        
-        for row in rows:
-            knowledge = (row["knowledge_list"][:200] + "...") if row["knowledge_list"] else "General application"
-            level = row["proficiency"] if row["proficiency"] else "Standard"
-            
-            skills_text += f"Ref Code: [{row['skill_code']}]\n"
-            skills_text += f"Skill Title: {row['title']}\n"
-            skills_text += f"Required Level: {level}\n"
-            skills_text += f"Key Knowledge: {knowledge}\n"
-            skills_text += "-" * 20 + "\n"
-        
-        return skills_text
-
+        result = _load_detailed_skills(role_name)
     except Exception as e:
         logger.error(f"Error fetching skills: {e}", exc_info=True)
         return "Standard industry skills."
+    if result is None:
+        # Unknown role names come from the client; don't let them fill the cache
+        return f"Standard industry spec for {role_name} (No specific DB entry)."
+    _detailed_skills_cache.set(role_name, result)
+    return result
+
+def peek_detailed_skills(role_name):
+    """Returns the cached spec for role_name, or None. Never touches the DB."""
+    return _detailed_skills_cache.get(role_name)
+
+# Explicit caches (not lru_cache) so callers on the event loop can check for a
+# warm entry and skip the thread-pool hop. Only roles found in the DB are stored.
+_detailed_skills_cache = LRUCache(maxsize=256)
+_match_skills_cache = LRUCache(maxsize=256)
+_match_skills_json_cache = LRUCache(maxsize=256)
+
+def _load_detailed_skills(role_name):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    logger.info(f"Fetching detailed skills spec for: {role_name}")
+    cursor.execute(_Q_DETAILED_SKILLS, (role_name,))
+    rows = cursor.fetchall()
+    
+    if not rows:
+        return None
+
+    parts = [f"OFFICIAL SPECIFICATION FOR ROLE: {role_name.upper()}\n", "=" * 40 + "\n\n"]
+    
+    for title, code, proficiency, knowledge_list in rows:
+        knowledge = (knowledge_list + "...") if knowledge_list else "General application"
+        level = proficiency if proficiency else "Standard"
+        
+        parts.append(
+            f"Ref Code: [{code}]\n"
+            f"Skill Title: {title}\n"
+            f"Required Level: {level}\n"
+            f"Key Knowledge: {knowledge}\n"
+            + "-" * 20 + "\n"
+        )
+    
+    return "".join(parts)
+
+# Used when a role has no rows; not cached, since role names come from the client
+_DEFAULT_MATCH_SKILLS = (
+    {"skill": "General Competency", "code": "N/A", "level": "Standard", "required_knowledge": "General professional skills"},
+)
 
 def get_match_skills_data(target_role):
     """
     Extracted logic from the /match_skills endpoint.
     Returns a formatted list of skills for the AI.
     """
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # The exact query from your main.py
-        query = """
-            SELECT 
-                COALESCE(s.title, rs.skill_title) as title, 
-                rs.skill_code, 
-                rs.proficiency,
-                GROUP_CONCAT(d.detail_item, '; ') as knowledge_list
-            FROM role_skills rs 
-            LEFT JOIN skill_definitions s ON rs.skill_code = s.skill_code 
-            LEFT JOIN skill_details d ON rs.skill_code = d.skill_code
-            WHERE rs.role = ? 
-            GROUP BY rs.skill_code
-            LIMIT 8
-        """
-        cursor.execute(query, (target_role,))
-        rows = cursor.fetchall()
-        conn.close()
-        
-        detailed_skills = []
-        for row in rows:
-            detailed_skills.append({
-                "skill": row["title"],
-                "code": row["skill_code"],
-                "level": row["proficiency"] if row["proficiency"] else "Standard", 
-                "required_knowledge": (row["knowledge_list"][:300] + "...") if row["knowledge_list"] else "General competency"
-            })
-
-        # Fallback logic moved here
-        if not detailed_skills:
-                logger.warning(f"No skills found for {target_role}, using default fallback.")
-                detailed_skills = [{"skill": "General Competency", "code": "N/A", "level": "Standard", "required_knowledge": "General professional skills"}]
-        
-        return detailed_skills
-
-    except Exception as e:
-        logger.error(f"Error in get_match_skills_data: {e}", exc_info=True)
-        return []
\ No newline at end of file
+    cached = _match_skills_cache.get(target_role)
+    if cached is None:
+        try:
+            cached = _load_match_skills_data(target_role)
+        except Exception as e:
+            logger.error(f"Error in get_match_skills_data: {e}", exc_info=True)
+            return []
+        if cached is None:
+            # Fallback logic moved here; unknown roles are not cached
+            logger.warning(f"No skills found for {target_role}, using default fallback.")
+            cached = _DEFAULT_MATCH_SKILLS
+        else:
+            _match_skills_cache.set(target_role, cached)
+    # Fresh dicts per caller so nobody can mutate the cached entry
+    return [dict(skill) for skill in cached]
+
+def get_match_skills_json(target_role):
+    """
+    Returns (skills_json, count) for the Skill Matcher prompt.
+    The JSON depends only on the role, so it is serialised once per role and
+    cached next to its length. Compact on purpose: indentation only costs prompt tokens.
+    """
+    cached = _match_skills_json_cache.get(target_role)
+    if cached is not None:
+        return cached
+    skills = get_match_skills_data(target_role)
+    result = (orjson.dumps(skills).decode(), len(skills))
+    # Only pin roles whose skills were found (not failures or the default list)
+    if _match_skills_cache.get(target_role) is not None:
+        _match_skills_json_cache.set(target_role, result)
+    return result
+
+def peek_match_skills_json(target_role):
+    """Returns the cached (skills_json, count) for target_role, or None. Never touches the DB."""
+    return _match_skills_json_cache.get(target_role)
+
+def _load_match_skills_data(target_role):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(_Q_MATCH_SKILLS, (target_role,))
+    rows = cursor.fetchall()
+    
+    detailed_skills = tuple(
+        {
+            "skill": title,
+            "code": code,
+            "level": proficiency if proficiency else "Standard", 
+            "required_knowledge": (knowledge_list + "...") if knowledge_list else "General competency"
+        }
+        for title, code, proficiency, knowledge_list in rows
+    )
+
+    return detailed_skills or None
+
+def clear_role_caches():
+    """Drops memoised role lookups (call after the database is reloaded)."""
+    _detailed_skills_cache.clear()
+    _match_skills_cache.clear()
+    _match_skills_json_cache.clear()
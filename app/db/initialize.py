@@ -1,197 +1,350 @@
 import sqlite3
-import pandas as pd
+import openpyxl
 import os
-import json
+import ijson
 import requests
 import logging
-from app.core.config import settings
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from app.core.config import settings, logger, make_queue_handler
+from app.db import database
 from pinecone import Pinecone
 from app.services.ai_service import mask_key
 
 # --- LOGGER SETUP ---
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler("backend.log"),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+# Handlers go on our own "app" package logger (app.db.*, app.routers.*, ...),
+# never on the root logger, so third-party libraries don't write through them.
+# File + console writes happen on a background QueueListener thread.
+def _setup_app_logging():
+    app_logger = logging.getLogger("app")
+    if app_logger.handlers:
+        return
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    file_handler = logging.FileHandler("backend.log")
+    stream_handler = logging.StreamHandler()
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler, _ = make_queue_handler(file_handler, stream_handler)
+    app_logger.addHandler(queue_handler)
+    app_logger.setLevel(logging.INFO)
+    app_logger.propagate = False
+
+    # Chatty HTTP clients only surface problems
+    for name in ("httpx", "httpcore", "urllib3", "openai", "pinecone"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+_setup_app_logging()
 
 # --- CONFIGURATION ---
-CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(settings.DB_PATH)
-JSON_PATH = os.path.join(settings.JSON_PATH)
-EXCEL_FILE = os.path.join(settings.EXCEL_PATH)
-STAR_FILE = os.path.join(settings.STAR_GUIDE_PATH)
+# All paths come from the single app.core.config module
+DB_FILE = settings.DB_PATH
+JSON_PATH = settings.JSON_PATH
+EXCEL_FILE = settings.EXCEL_PATH
+STAR_FILE = settings.STAR_GUIDE_PATH
 
 # Github URLs (Keep your existing URLs)
 GITHUB_EXCEL_URL = "https://raw.githubusercontent.com/larrysimm/skills-data-static/main/jobsandskills-skillsfuture-skills-framework-dataset.xlsx"
 GITHUB_STAR_URL = "https://raw.githubusercontent.com/larrysimm/skills-data-static/main/star_guide.pdf"
 QUESTION_JSON_URL = "https://raw.githubusercontent.com/larrysimm/skills-data-static/main/questions.json"
 
-def download_file(url, filepath, description):
-    if os.path.exists(filepath):
-        logger.info(f"📂 {description} found locally.")
-        return
-    logger.info(f"⬇️ Downloading {description} from {url}")
+def download_file(url, filepath, description, require_etag=False):
+    """
+    Returns True if `filepath` is current afterwards (downloaded, revalidated,
+    or found locally), False if the download failed.
+    With require_etag, a local copy without an ETag sidecar (seeded on an earlier
+    boot, baked into the image) is not trusted and is downloaded again.
+    """
+    # The ETag of the last download is kept next to the file so a present copy
+    # can be revalidated with a ~100 B conditional GET instead of re-fetched.
+    etag_path = filepath + ".etag"
+    headers = {}
+    if os.path.exists(filepath) and (os.path.exists(etag_path) or not require_etag):
+        if not os.path.exists(etag_path):
+            logger.info(f"📂 {description} found locally.")
+            return True
+        with open(etag_path, "r", encoding="utf-8") as f:
+            headers["If-None-Match"] = f.read().strip()
+        logger.info(f"🔎 Revalidating local {description}...")
+    else:
+        logger.info(f"⬇️ Downloading {description} from {url}")
+    # Stream to a temp file in 64 KB chunks (constant memory), then rename so an
+    # interrupted download is never mistaken for a complete local copy.
+    tmp_path = filepath + ".part"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        with open(filepath, "wb") as f:
-            f.write(response.content)
+        with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+            if response.status_code == 304:
+                logger.info(f"📂 {description} unchanged, using local copy.")
+                return True
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+            etag = response.headers.get("ETag")
+        os.replace(tmp_path, filepath)
+        if etag:
+            with open(etag_path, "w", encoding="utf-8") as f:
+                f.write(etag)
+        elif os.path.exists(etag_path):
+            os.remove(etag_path)
         logger.info(f"✅ Download complete: {filepath}")
+        return True
     except Exception as e:
+        # Callers that can live with a stale copy simply ignore the result
         logger.error(f"❌ Failed to download {description}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+# --- EXCEL SHEET -> TABLE MAPPING ---
+# Sheet name: (table, {Excel header: column}). Only these columns are read.
+EXCEL_TABLES = {
+    # --- 1. Descriptions ---
+    "Job Role_Description": ("role_descriptions", {
+        'Job Role': 'role',
+        'Job Role Description': 'description',
+        'Performance Expectation': 'expectations'
+    }),
+    # --- 2. Tasks ---
+    "Job Role_CWF_KT": ("role_tasks", {
+        'Job Role': 'role',
+        'Critical Work Function': 'function',
+        'Key Tasks': 'task'
+    }),
+    # --- 3. Role-Skill Map ("Proficiency Level" -> "proficiency" is what the API reads) ---
+    "Job Role_TCS_CCS": ("role_skills", {
+        'Job Role': 'role',
+        'TSC_CCS Title': 'skill_title',
+        'TSC_CCS Code': 'skill_code',
+        'Proficiency Level': 'proficiency'
+    }),
+    # --- 4. Skill Definitions ---
+    "TSC_CCS_Key": ("skill_definitions", {
+        'TSC Code': 'skill_code',
+        'TSC_CCS Title': 'title',
+        'TSC_CCS Description': 'description'
+    }),
+    # --- 5. Skill Details ---
+    "TSC_CCS_K&A": ("skill_details", {
+        'TSC_CCS Code': 'skill_code',
+        'Knowledge / Ability Items': 'detail_item'
+    }),
+}
+
+def _sheet_rows(ws, headers):
+    """
+    Returns a generator of tuples holding only the wanted columns of each data row.
+    The header row is read eagerly so a missing column fails before any table is touched.
+    """
+    header = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    positions = [header.index(h) for h in headers]
+
+    # Only parse the column span we need; cells outside it are never materialised
+    first, last = min(positions), max(positions)
+    pick = itemgetter(*(p - first for p in positions))
+    rows = ws.iter_rows(min_row=2, min_col=first + 1, max_col=last + 1, values_only=True)
+
+    def generate():
+        for row in rows:
+            try:
+                values = pick(row)
+            except IndexError:  # short row (trailing cells empty)
+                values = tuple(row[p - first] if p - first < len(row) else None for p in positions)
+            if any(v is not None for v in values):  # skip blank lines
+                yield values
+
+    return generate()
+
+def load_sheet(conn, ws, table, columns):
+    """Replaces `table` with the mapped columns of worksheet `ws`, streamed through executemany."""
+    rows = _sheet_rows(ws, list(columns))
+    names = list(columns.values())
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    # Columns are declared without a type so each cell keeps the type openpyxl
+    # read (e.g. proficiency 3 stays an integer, as it did with pandas.to_sql)
+    conn.execute(f"CREATE TABLE {table} ({', '.join(names)})")
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+        rows
+    )
+
+def ensure_columns(conn, table, columns):
+    """
+    Creates `table` if missing, then adds any of `columns` ({name: type}) an older
+    database file lacks, so upgraded deployments get the same schema as fresh ones.
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{n} {t}' for n, t in columns.items())})")
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, col_type in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
+def has_unique_index(conn, table, column):
+    """True if `column` alone already has a unique index (inline UNIQUE or CREATE UNIQUE INDEX)."""
+    for _, name, unique, *_ in conn.execute(f"PRAGMA index_list({table})"):
+        if unique and [row[2] for row in conn.execute(f"PRAGMA index_info({name})")] == [column]:
+            return True
+    return False
+
+def fetch_prebuilt_db():
+    """
+    Downloads (or revalidates) the prebuilt database when DB_RELEASE_URL is set.
+    Returns True if a usable SQLite file is in place, False to fall back to seeding.
+    """
+    if not settings.DB_RELEASE_URL:
+        return False
+    # Only a copy that revalidates against the release counts; anything else
+    # (no ETag, or the fetch failed) falls back to seeding from the sources
+    if not download_file(settings.DB_RELEASE_URL, DB_FILE, "Prebuilt Database", require_etag=True):
+        # Seeding rewrites the file, so its old ETag no longer describes it
+        if os.path.exists(DB_FILE + ".etag"):
+            os.remove(DB_FILE + ".etag")
+        return False
+    try:
+        with open(DB_FILE, "rb") as f:
+            if f.read(16) == b"SQLite format 3\x00":
+                return True
+    except OSError:
+        return False
+    logger.warning("⚠️ Prebuilt database is not a SQLite file, rebuilding from sources")
+    os.remove(DB_FILE)
+    return False
 
 def init_db():
     logger.info("🚀 Starting Database Initialization...")
-    download_file(GITHUB_EXCEL_URL, EXCEL_FILE, "Excel Dataset")
-    download_file(GITHUB_STAR_URL, STAR_FILE, "Star Guide")
-    download_file(QUESTION_JSON_URL, JSON_PATH, "Questions JSON")
+    if fetch_prebuilt_db():
+        # The STAR guide is read at startup separately from the database
+        download_file(GITHUB_STAR_URL, STAR_FILE, "Star Guide")
+        logger.info("✅ SUCCESS! Using prebuilt database.")
+        database.clear_role_caches()
+        log_table_counts()
+        return
+
+    downloads = [
+        (GITHUB_EXCEL_URL, EXCEL_FILE, "Excel Dataset"),
+        (GITHUB_STAR_URL, STAR_FILE, "Star Guide"),
+        (QUESTION_JSON_URL, JSON_PATH, "Questions JSON"),
+    ]
+    # Independent and network-bound: fetch them concurrently
+    with ThreadPoolExecutor(max_workers=len(downloads)) as pool:
+        list(pool.map(lambda args: download_file(*args), downloads))
 
     conn = sqlite3.connect(DB_FILE)
-    
+    # Bulk-seed settings: everything written here is rebuilt from the downloaded
+    # sources on every boot, so trade durability for insert speed while seeding.
+    # MEMORY (not WAL) also takes the file out of WAL mode: readers open it with
+    # mode=ro, which cannot attach to a WAL database whose -wal/-shm files are gone.
     conn.executescript("""
-        CREATE TABLE IF NOT EXISTS role_descriptions (
-            role TEXT, description TEXT, expectations TEXT
-        );
-        CREATE TABLE IF NOT EXISTS skill_definitions (
-            skill_code TEXT PRIMARY KEY, title TEXT, definition TEXT
-        );
-        CREATE TABLE IF NOT EXISTS role_skills (
-            role TEXT, skill_code TEXT, proficiency TEXT, skill_title TEXT
-        );
-        CREATE TABLE IF NOT EXISTS skill_details (
-            skill_code TEXT, detail_item TEXT
-        );
-        CREATE TABLE IF NOT EXISTS saved_questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, question_text TEXT UNIQUE
-        );
+        PRAGMA journal_mode=MEMORY;
+        PRAGMA synchronous=OFF;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
     """)
     
+    # Empty placeholders (same schema load_sheet() builds) so queries still work
+    # when the Excel file is unavailable
+    for table, columns in EXCEL_TABLES.values():
+        ensure_columns(conn, table, {name: "" for name in columns.values()})
+    conn.commit()
+    
     try:
         if os.path.exists(EXCEL_FILE):
             logger.info("⚙️  Creating Database Tables from Excel...")
-            xls = pd.ExcelFile(EXCEL_FILE)
-
-            # --- 1. Descriptions ---
-            if "Job Role_Description" in xls.sheet_names:
-                logger.info("   -> Creating Role Descriptions Table")
-                df = pd.read_excel(xls, sheet_name="Job Role_Description")
-                # CLEANUP: Rename columns to match what your API expects
-                df = df.rename(columns={
-                    'Job Role': 'role',
-                    'Job Role Description': 'description',
-                    'Performance Expectation': 'expectations'
-                })
-                df[['role', 'description', 'expectations']].to_sql('role_descriptions', conn, if_exists='replace', index=False)
-                logger.info("   -> Role Descriptions Table Created")
-
-            # --- 2. Tasks ---
-            if "Job Role_CWF_KT" in xls.sheet_names:
-                logger.info("   -> Creating Role Tasks Table")
-                df = pd.read_excel(xls, sheet_name="Job Role_CWF_KT")
-                df = df.rename(columns={
-                    'Job Role': 'role',
-                    'Critical Work Function': 'function',
-                    'Key Tasks': 'task'
-                })
-                df[['role', 'function', 'task']].to_sql('role_tasks', conn, if_exists='replace', index=False)
-                logger.info("   -> Role Tasks Table Created")
-
-            # --- 3. Role-Skill Map (THIS FIXES YOUR ERROR) ---
-            if "Job Role_TCS_CCS" in xls.sheet_names:
-                logger.info("   -> Creating Role-Skill Map Table")
-                df = pd.read_excel(xls, sheet_name="Job Role_TCS_CCS")
-                
-                # 🛑 CRITICAL FIX: Rename "Proficiency Level" to "proficiency"
-                df = df.rename(columns={
-                    'Job Role': 'role',
-                    'TSC_CCS Title': 'skill_title',
-                    'TSC_CCS Code': 'skill_code',
-                    'Proficiency Level': 'proficiency'  # <--- THIS IS THE FIX
-                })
-                
-                # Select only the renamed columns to be safe
-                df = df[['role', 'skill_title', 'skill_code', 'proficiency']]
-                df.to_sql('role_skills', conn, if_exists='replace', index=False)
-                logger.info("   -> Role-Skill Table Created")
-
-            # --- 4. Skill Definitions ---
-            if "TSC_CCS_Key" in xls.sheet_names:
-                logger.info("   -> Creating Skill Definitions Table")
-                df = pd.read_excel(xls, sheet_name="TSC_CCS_Key")
-                df = df.rename(columns={
-                    'TSC Code': 'skill_code',
-                    'TSC_CCS Title': 'title',
-                    'TSC_CCS Description': 'description'
-                })
-                df[['skill_code', 'title', 'description']].to_sql('skill_definitions', conn, if_exists='replace', index=False)
-                logger.info("   -> Skill Definitions Table Created")
-
-            # --- 5. Skill Details ---
-            if "TSC_CCS_K&A" in xls.sheet_names:
-                logger.info("   -> Creating Skill Details Table")
-                df = pd.read_excel(xls, sheet_name="TSC_CCS_K&A")
-                df = df.rename(columns={
-                    'TSC_CCS Code': 'skill_code',
-                    'Knowledge / Ability Items': 'detail_item'
-                })
-                df[['skill_code', 'detail_item']].to_sql('skill_details', conn, if_exists='replace', index=False)
-                logger.info("   -> Skill Details Table Created")
+            # read_only streams each sheet row by row instead of building a DataFrame
+            wb = openpyxl.load_workbook(EXCEL_FILE, read_only=True, data_only=True, keep_links=False)
+            try:
+                # All sheets are replaced in one explicit transaction: one journal
+                # flush for the whole ingest, and readers never see a half-built set
+                conn.execute("BEGIN IMMEDIATE")
+                for sheet_name, (table, columns) in EXCEL_TABLES.items():
+                    if sheet_name in wb.sheetnames:
+                        logger.info(f"   -> Creating {table} Table")
+                        load_sheet(conn, wb[sheet_name], table, columns)
+                        logger.info(f"   -> {table} Table Created")
+                conn.commit()
+            finally:
+                wb.close()
 
     except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
         logger.error(f"❌ Database Creation Error: {e}", exc_info=True)
 
+    # --- Lookup Indexes ---
+    # Created after the Excel load because load_sheet() drops and recreates the tables
+    try:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_role_skills_role ON role_skills(role, skill_code)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_skill_details_code ON skill_details(skill_code)")
+    except Exception as e:
+        logger.error(f"❌ Index Creation Error: {e}")
+
     # --- Create Questions Table ---
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS saved_questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question_text TEXT UNIQUE, 
-            category TEXT DEFAULT 'General'
-        )
-    """)
+    # A fresh table is created without the UNIQUE constraint so the bulk insert
+    # doesn't maintain an index row by row; duplicates are dropped in Python and
+    # the unique index is built once the rows are in.
+    ensure_columns(conn, "saved_questions", {
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "question_text": "TEXT",
+        "category": "TEXT DEFAULT 'General'",
+    })
+    first_seed = conn.execute("SELECT COUNT(*) FROM saved_questions").fetchone()[0] == 0
 
     try:
         if os.path.exists(JSON_PATH):
-            with open(JSON_PATH, "r", encoding="utf-8") as f:
-                questions_data = json.load(f)
-                
-            logger.info(f"📂 Loading {len(questions_data)} questions from JSON...")
-            
-            # Insert questions (ignoring duplicates)
-            for q in questions_data:
+            logger.info("📂 Loading questions from JSON...")
+            with open(JSON_PATH, "rb") as f:
+                # Stream array items one at a time instead of json.load()-ing the whole file
+                questions_data = ijson.items(f, "item")
+
                 # Handle cases where JSON is a list of strings OR list of objects
-                q_text = q if isinstance(q, str) else q.get("question", "")
-                
-                if q_text:
-                    conn.execute(
+                q_texts = (q if isinstance(q, str) else q.get("question", "") for q in questions_data)
+                q_texts = (q_text for q_text in q_texts if q_text)
+                if first_seed:
+                    seen = set()
+                    q_texts = (q for q in q_texts if not (q in seen or seen.add(q)))
+
+                # Later boots rely on the unique index (INSERT OR IGNORE) to skip duplicates
+                with conn:
+                    cursor = conn.executemany(
                         "INSERT OR IGNORE INTO saved_questions (question_text) VALUES (?)", 
-                        (q_text,)
+                        ((q_text,) for q_text in q_texts)
                     )
-            logger.info("✅ Questions successfully seeded into DB.")
+            logger.info(f"✅ Questions successfully seeded into DB ({cursor.rowcount} new).")
         else:
             logger.warning(f"⚠️ questions.json not found at {JSON_PATH}")
             
     except Exception as e:
         logger.error(f"❌ Error loading questions from JSON: {e}")
+
+    try:
+        # Databases created before this change carry an inline UNIQUE autoindex;
+        # a second unique index on the same column would just double the upkeep
+        if not has_unique_index(conn, "saved_questions", "question_text"):
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_text ON saved_questions(question_text)")
+    except Exception as e:
+        logger.error(f"❌ Index Creation Error: {e}")
         
     conn.commit()
-    conn.close()
+    # Back to safe defaults (and a persistent rollback journal) once seeded
+    conn.executescript("""
+        PRAGMA journal_mode=DELETE;
+        PRAGMA synchronous=FULL;
+    """)
     logger.info(f"✅ SUCCESS! Database ready.")
-    log_table_counts()
-
-import sqlite3
-from ..core.config import settings, logger  # Ensure these are imported
+    # Role lookups memoised before this load would now be stale
+    database.clear_role_caches()
+    # Reuse the seeding connection (and its statement cache) for the stats pass
+    log_table_counts(conn)
+    conn.close()
 
-def log_table_counts():
+def log_table_counts(conn=None):
     """Helper to print row counts and top 5 rows for every table."""
+    own_conn = conn is None
     try:
-        # Create a temporary connection just for checking stats
-        conn = sqlite3.connect(settings.DB_PATH)
+        if own_conn:
+            # Standalone call: open a temporary connection just for checking stats
+            conn = sqlite3.connect(settings.DB_PATH)
         cursor = conn.cursor()
         
         # 1. Get a list of all tables (excluding internal sqlite tables)
@@ -231,7 +384,8 @@ def log_table_counts():
                 logger.info("      " + "-"*50)
 
         logger.info("----------------------------------------")
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except Exception as e:
         logger.error(f"❌ Error logging table stats: {e}")
@@ -1,95 +1,107 @@
+import asyncio
+import gc
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from dotenv import load_dotenv
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
-from app.db import initialize 
-from app.core.config import settings, logger
+from app.db import initialize, database
+from app.core.config import settings, logger, start_logging, stop_logging
+from app.middleware import AuthAndLogMiddleware
 from app.services import ai_service
 from app.routers import interview, skills, audio
 
-load_dotenv()
-app = FastAPI(title="Poly-to-Pro", version="3.0.0")
+async def _timed_step(name, *steps):
+    """Runs blocking init steps in order on a worker thread and logs how long they took."""
+    start = time.perf_counter()
+    for step in steps:
+        await asyncio.to_thread(step)
+    logger.info(f"   -> {name} ready in {time.perf_counter() - start:.2f}s")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["https://larrysim-iti123-project.netlify.app"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-app.include_router(interview.router, prefix="/api/interview", tags=["Interview"])
-app.include_router(skills.router, prefix="/api/skills", tags=["Skills"])
-app.include_router(audio.router, prefix="/api/audio", tags=["Audio"])
-
-@app.on_event("startup")
 async def startup_event():
+    # No-op on first start; resumes log output if an earlier app's shutdown stopped it
+    start_logging()
     logger.info(">>> SERVER STARTING UP <<<")
 
-    initialize.init_db()
-    initialize.verify_pinecone_connection()
-    ai_service.init_ai_models()
-    ai_service.load_prompts()
-    ai_service.load_star_guide()
+    # Size the pool behind asyncio.to_thread explicitly (PDF parsing and the
+    # blocking guardrail calls share it); DB lookups have their own pool.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=settings.THREAD_POOL_SIZE, thread_name_prefix="worker")
+    )
+
+    # Independent init work overlaps; the STAR guide is only read after
+    # init_db has downloaded it, so those two share one chain.
+    steps = {
+        "Database + STAR Guide": (initialize.init_db, ai_service.load_star_guide),
+        "Pinecone": (initialize.verify_pinecone_connection,),
+        "AI Models": (ai_service.init_ai_models,),
+        "Prompts": (ai_service.load_prompts,),
+    }
+    results = await asyncio.gather(
+        *(_timed_step(name, *fns) for name, fns in steps.items()),
+        return_exceptions=True,
+    )
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ Startup step '{name}' failed: {result}", exc_info=result)
+
+    # Clear init garbage once, then move everything still alive (models, prompts,
+    # STAR guide, clients) out of the collector's view so later full collections
+    # don't keep rescanning this long-lived working set.
+    gc.collect()
+    gc.freeze()
 
     logger.info("Server is ready to accept requests.")
 
-@app.on_event("shutdown")
 async def shutdown_event():
     logger.info(">>> SERVER SHUTTING DOWN <<<")
+    database.shutdown_db_pool()
+    # Flush queued log records (incl. Logtail) before the process exits
+    stop_logging()
 
-@app.middleware("http")
-async def verify_secret_header(request: Request, call_next):
-    # Allow OPTIONS requests (needed for CORS pre-flight checks)
-    if request.method == "OPTIONS":
-        return await call_next(request)
-        
-    # Public endpoints (like docs or root) can be excluded if you want
-    if request.url.path in ["/", "/docs", "/openapi.json", "/api/audio/transcribe"]:
-         return await call_next(request)
-
-    # Check for the secret header
-    client_secret = request.headers.get("X-Poly-Secret")
-    
-    if client_secret != settings.API_SECRET:
-        return JSONResponse(
-            status_code=401,
-            content={"detail": "Unauthorized: Invalid Secret"}
-        )  
-    
-    response = await call_next(request)
-    return response
-
-@app.middleware("http")
-async def log_visits(request: Request, call_next):
-    start_time = time.time()
-    
-    response = await call_next(request)
-    
-    process_time = time.time() - start_time
-    
-    # Filter out noise
-    if request.url.path not in ["/favicon.ico", "/openapi.json", "/docs"] and request.method != "OPTIONS":
-        log_data = {
-            "event": "api_hit",
-            "method": request.method,
-            "path": request.url.path,
-            "status": response.status_code,
-            "duration": round(process_time, 4),
-            "ip": request.client.host
-        }
-        # Send JSON data to Better Stack
-        logger.info(f"API Request: {request.url.path}", extra=log_data)
-        
-    return response
-
-@app.get("/")
 async def root():
     return {
         "message": "Poly-to-Pro API is running!",
         "docs": "/docs",
         "status": "OK"
-    }
\ No newline at end of file
+    }
+
+async def clear_cache():
+    """Drops cached role lookups, e.g. after the skills DB has been reloaded."""
+    database.clear_role_caches()
+    logger.info("🧹 Role lookup caches cleared.")
+    return {"status": "OK"}
+
+def create_app() -> FastAPI:
+    """Builds the configured API app (middleware, routers, lifecycle hooks)."""
+    # orjson for every JSON body the routes return
+    app = FastAPI(
+        title=settings.PROJECT_NAME,
+        version=settings.VERSION,
+        default_response_class=ORJSONResponse,
+    )
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["https://larrysim-iti123-project.netlify.app"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Added after CORS so it is the outermost layer
+    app.add_middleware(AuthAndLogMiddleware)
+
+    app.include_router(interview.router, prefix="/api/interview", tags=["Interview"])
+    app.include_router(skills.router, prefix="/api/skills", tags=["Skills"])
+    app.include_router(audio.router, prefix="/api/audio", tags=["Audio"])
+
+    app.add_api_route("/", root, methods=["GET"])
+    app.add_api_route("/api/admin/clear_cache", clear_cache, methods=["POST"])
+
+    app.add_event_handler("startup", startup_event)
+    app.add_event_handler("shutdown", shutdown_event)
+    return app
+
+app = create_app()
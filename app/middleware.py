@@ -0,0 +1,94 @@
+import hmac
+import time
+
+import orjson
+
+from app.core.config import settings, logger
+
+# Endpoints reachable without the X-Poly-Secret header
+PUBLIC_PATHS = frozenset({"/", "/docs", "/openapi.json", "/api/audio/transcribe"})
+
+# Endpoints not worth an api_hit log line
+UNLOGGED_PATHS = frozenset({"/favicon.ico", "/openapi.json", "/docs"})
+
+# Encoded once; the 401 path never builds a response object
+_UNAUTHORIZED_BODY = orjson.dumps({"detail": "Unauthorized: Invalid Secret"})
+
+
+class AuthAndLogMiddleware:
+    """
+    Secret-header check and API hit logging in a single pure ASGI layer.
+    Headers are read straight from the scope, so no Request/Response objects
+    are built for the check, and a rejected call never reaches the app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.secret = settings.API_SECRET.encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Monotonic integer clock: cheap, and immune to wall-clock adjustments
+        start_ns = time.perf_counter_ns()
+        method = scope["method"]
+        path = scope["path"]
+        # Filter out noise
+        should_log = path not in UNLOGGED_PATHS and method != "OPTIONS"
+        logged = False
+
+        def log_hit(status_code):
+            nonlocal logged
+            logged = True
+            client = scope.get("client")
+            log_data = {
+                "event": "api_hit",
+                "method": method,
+                "path": path,
+                "status": status_code,
+                "duration": round((time.perf_counter_ns() - start_ns) / 1e9, 4),
+                "ip": client[0] if client else None
+            }
+            # Send JSON data to Better Stack
+            logger.info(f"API Request: {path}", extra=log_data)
+
+        async def send_and_record(message):
+            # Logged when the headers go out, so "duration" is time-to-headers
+            # (not the length of a streamed body) and the line isn't held back
+            # until a long NDJSON stream finishes.
+            if should_log and not logged and message["type"] == "http.response.start":
+                log_hit(message["status"])
+            await send(message)
+
+        try:
+            # Allow OPTIONS requests (needed for CORS pre-flight checks)
+            if method == "OPTIONS" or path in PUBLIC_PATHS or self._has_valid_secret(scope):
+                await self.app(scope, receive, send_and_record)
+            else:
+                await self._unauthorized(send_and_record)
+        finally:
+            # The app failed before sending any response
+            if should_log and not logged:
+                log_hit(None)
+
+    def _has_valid_secret(self, scope) -> bool:
+        # ASGI header names are already lower-cased bytes
+        for name, value in scope["headers"]:
+            if name == b"x-poly-secret":
+                # Constant-time so response timing doesn't leak how much of the secret matched
+                return hmac.compare_digest(value, self.secret)
+        return False
+
+    @staticmethod
+    async def _unauthorized(send):
+        await send({
+            "type": "http.response.start",
+            "status": 401,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(_UNAUTHORIZED_BODY)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": _UNAUTHORIZED_BODY})
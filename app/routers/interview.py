@@ -1,27 +1,53 @@
-import json
 import logging
-import asyncio
 
 from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from app.schemas import AnalyzeRequest 
 from app.services import ai_service
 from app.db import database
 from app.utils import parsers
+from app.utils.streaming import NDJSON_HEADERS, buffered, frame, drain
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Fixed progress events, encoded once at import
+STEP_GATHERING = frame({"type": "step", "step_id": 1, "message": "Gathering Context..."})
+STEP_READING = frame({"type": "step", "step_id": 1, "message": "Reading Context..."})
+STEP_MANAGER = frame({"type": "step", "step_id": 2, "message": "Manager Analysis..."})
+STEP_COACH = frame({"type": "step", "step_id": 3, "message": "Coach Refinement..."})
+
+async def _token_frames(agent, chunks, parts):
+    """
+    Relays streamed model text as "token" frames while collecting it in `parts`.
+    A None chunk means the provider failed mid-answer and the next one starts over.
+    """
+    async for chunk in chunks:
+        if chunk is None:
+            parts.clear()
+            yield frame({"type": "token_reset", "agent": agent})
+        else:
+            parts.append(chunk)
+            yield frame({"type": "token", "agent": agent, "text": chunk})
+
 @router.post("/analyze_stream")
 async def analyze_stream(request: AnalyzeRequest):
     async def event_generator():
+        # Frames produced microseconds apart are sent as one body chunk; the
+        # buffer is flushed right before each await that really waits.
+        pending = bytearray()
         try:
             # 1. Context
-            yield json.dumps({"type": "step", "step_id": 1, "message": "Gathering Context..."}) + "\n"
-            loop = asyncio.get_event_loop()
-            detailed_skills_str = await loop.run_in_executor(None, database.get_detailed_skills, request.target_role)
-            
+            pending += STEP_GATHERING
+            # Manager needs the DB context and Coach needs Manager's critique, so the
+            # LLM calls stay sequential; only the DB lookup overlaps the prep below.
+            # A warm role is served from the cache without a thread-pool hop.
+            detailed_skills_str = database.peek_detailed_skills(request.target_role)
+            skills_future = None
+            if detailed_skills_str is None:
+                skills_future = database.run_in_db_pool(database.get_detailed_skills, request.target_role)
+
             skill_gaps_str = "No specific gaps identified."
             if request.skill_data and "missing" in request.skill_data:
                 missing = request.skill_data["missing"]
@@ -30,51 +56,65 @@ async def analyze_stream(request: AnalyzeRequest):
                         [f"- {m['skill']} ({m.get('code', 'N/A')}): {m.get('gap', '')}" for m in missing]
                     )
 
-            yield json.dumps({"type": "step", "step_id": 1, "message": "Reading Context..."}) + "\n"
+            pending += STEP_READING
+            if skills_future is not None:
+                if not skills_future.done():
+                    yield drain(pending)
+                detailed_skills_str = await skills_future
 
             # 2. Manager
-            yield json.dumps({"type": "step", "step_id": 2, "message": "Manager Analysis..."}) + "\n"
+            pending += STEP_MANAGER
+            yield drain(pending)
             
-            manager_res = await ai_service.run_chain_with_fallback(
+            manager_parts = []
+            manager_stream = ai_service.run_chain_with_fallback_stream(
                 ai_service.get_prompt("manager_prompt"),
                 {
                     "role": request.target_role,
                     "detailed_skills": detailed_skills_str,
-                    "resume_text": request.resume_text[:10000],
+                    "resume_text": request.resume_text,
                     "question": request.question,
                     "skill_gaps": skill_gaps_str,
                     "student_answer": request.student_answer
                 },
                 "Manager Agent"
             )
+            async for token_frame in _token_frames("manager", manager_stream, manager_parts):
+                yield token_frame
+            manager_res = "".join(manager_parts)
             
             # ✅ ROBUST PARSING
-            man_thinking, man_feedback = ai_service.parse_llm_response(manager_res)
+            man_thinking, man_feedback = await parsers.run_parser(ai_service.parse_llm_response, manager_res)
             
             # Send partial update (Thinking)
-            yield json.dumps({"type": "partial_update", "data": {"manager_thinking": man_thinking}}) + "\n"
+            pending += frame({"type": "partial_update", "data": {"manager_thinking": man_thinking}})
 
             # 3. Coach
-            yield json.dumps({"type": "step", "step_id": 3, "message": "Coach Refinement..."}) + "\n"
+            pending += STEP_COACH
+            yield drain(pending)
             
-            coach_res = await ai_service.run_chain_with_fallback(
+            coach_parts = []
+            coach_stream = ai_service.run_chain_with_fallback_stream(
                 ai_service.get_prompt("coach_prompt"),
                 {
                     "manager_critique": man_feedback, 
                     "student_answer": request.student_answer,
                     "star_guide_content": ai_service.STAR_GUIDE_TEXT,
                     "question": request.question,
-                    "resume_text": request.resume_text[:10000],
+                    "resume_text": request.resume_text,
                 },
                 "Coach Agent"
             )
+            async for token_frame in _token_frames("coach", coach_stream, coach_parts):
+                yield token_frame
+            coach_res = "".join(coach_parts)
 
-            coach_thinking, coach_json_str = ai_service.parse_llm_response(coach_res)
-            yield json.dumps({"type": "partial_update", "data": {"coach_thinking": coach_thinking}}) + "\n"
+            coach_thinking, coach_json_str = await parsers.run_parser(ai_service.parse_llm_response, coach_res)
+            pending += frame({"type": "partial_update", "data": {"coach_thinking": coach_thinking}})
 
             # ✅ ROBUST JSON (Prevents Crash)
             # If parsing fails, we default to a safe dictionary, NOT None.
-            coach_data = parsers.parse_json_safely(coach_json_str)
+            coach_data = await parsers.run_parser(parsers.parse_json_safely, coach_json_str)
             if not coach_data:
                 coach_data = {
                     "coach_critique": "Could not parse AI response.",
@@ -82,26 +122,30 @@ async def analyze_stream(request: AnalyzeRequest):
                 }
 
             # 4. Final Result
-            yield json.dumps({"type": "result", "data": {
+            pending += frame({"type": "result", "data": {
                 "manager_thinking": man_thinking,
                 "manager_critique": man_feedback,
                 "coach_thinking": coach_thinking,
                 "coach_critique": coach_data.get("coach_critique", "No critique available."),
                 "rewritten_answer": coach_data.get("rewritten_answer", "No answer generated.")
-            }}) + "\n"
+            }})
+            yield drain(pending)
 
         except Exception as e:
             logger.error(f"Stream Error: {e}", exc_info=True)
-            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+            pending += frame({"type": "error", "message": str(e)})
+            yield drain(pending)
 
-    return StreamingResponse(event_generator(), media_type="application/x-ndjson")
+    return StreamingResponse(buffered(event_generator()), media_type="application/x-ndjson", headers=NDJSON_HEADERS)
 
-@router.get("/roles")
+# Returning the response directly skips FastAPI's jsonable_encoder pass;
+# the DB rows are already plain JSON types.
+@router.get("/roles", response_class=ORJSONResponse)
 def get_roles():
     """Fetches list of available roles for the dropdown."""
-    return database.get_roles()
+    return ORJSONResponse(database.get_roles())
 
-@router.get("/questions")
+@router.get("/questions", response_class=ORJSONResponse)
 def get_questions():
     """Fetches list of interview questions."""
-    return database.get_questions()
\ No newline at end of file
+    return ORJSONResponse(database.get_questions())
\ No newline at end of file
@@ -1,18 +1,31 @@
-import json
 import logging
 import asyncio
 
 from app.services.guardrails import GuardrailService
-from fastapi import APIRouter, Request, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
+from app.core.config import settings
+from app.schemas import MatchRequest
 from app.services import ai_service
 from app.db import database
 from app.utils import parsers
+from app.utils.streaming import NDJSON_HEADERS, buffered, frame
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# PDF parsing runs on worker threads; cap how many parses (and their
+# in-memory documents) can be in flight at once.
+MAX_PARALLEL_PDFS = 4
+_pdf_slots = asyncio.Semaphore(MAX_PARALLEL_PDFS)
+
+# Status frames that never change between requests, encoded once
+STATUS_ANONYMIZING = frame({"type": "status", "step": 2, "message": "Anonymizing data & Initializing AI Analyst..."})
+STATUS_READING = frame({"type": "status", "step": 2, "message": "Reading resume work history..."})
+STATUS_MAPPING = frame({"type": "status", "step": 2, "message": "Mapping skills to gaps..."})
+STATUS_FORMATTING = frame({"type": "status", "step": 3, "message": "Formatting final JSON report..."})
+
 @router.post("/upload_resume")
 async def upload_resume(file: UploadFile = File(...)):
     """
@@ -27,31 +40,63 @@ async def upload_resume(file: UploadFile = File(...)):
     # --- SECURITY CHECK 2: File Size & Magic Bytes ---
     MAX_SIZE = 5 * 1024 * 1024  # 5MB
 
-    # We read the file content into memory. 
-    # NOTE: For 5MB this is fine. For large files (e.g., videos), use chunked reading.
-    content = await file.read()
+    CHUNK_SIZE = 64 * 1024
 
-    # 2.1: Check Real Size
-    if len(content) > MAX_SIZE:
-        raise HTTPException(status_code=413, detail="File too large. Max size is 5MB.")
+    # Starlette's multipart parser has already spooled the whole upload to a
+    # temp file before this handler runs; the checks below bound what is copied
+    # into process memory, not what is received.
 
-    # 2.2: Check Magic Bytes (Signature)
+    # 2.1: Check Magic Bytes (Signature) before copying the rest into memory
     # PDF files start with %PDF (bytes: 25 50 44 46)
-    if not content.startswith(b"%PDF"):
+    head = await file.read(4)
+    if head != b"%PDF":
         logger.warning(f"⚠️ Security Block: Magic Bytes mismatch for {file.filename}")
         raise HTTPException(status_code=400, detail="Invalid file format. Not a valid PDF.")
+
+    # 2.2: Check Real Size (running total)
+    # Copy the rest from the spooled file in chunks and stop once it crosses the
+    # limit, so at most MAX_SIZE of any upload is ever held in memory.
+    # The 4 signature bytes are kept, so no seek back is needed.
+    content = bytearray(head)
+    while chunk := await file.read(CHUNK_SIZE):
+        if len(content) + len(chunk) > MAX_SIZE:
+            raise HTTPException(status_code=413, detail="File too large. Max size is 5MB.")
+        content += chunk
     
     # --- PROCESSING: Text Extraction ---
     try:
-        text = parsers.extract_text_from_pdf(content)
+        # CPU-bound PDF parsing happens off the event loop
+        async with _pdf_slots:
+            text = await asyncio.to_thread(parsers.extract_text_from_pdf, content, settings.RESUME_MAX_CHARS)
 
-        # --- SECURITY CHECK 3: Guardrail Jailbreak Detection ---
         if not text:
             raise HTTPException(status_code=400, detail="Could not read PDF text.")
 
-        is_attack, guard_usage = GuardrailService.detect_jailbreak(text[:2000])
+        # --- LOGIC CHECK: Is it a scanned image? ---
+        if len(text.strip()) < 50:
+            logger.warning(f"⚠️ OCR Required: File {file.filename} contains almost no text.")
+            return ORJSONResponse({
+                "filename": file.filename, 
+                "status": "partial_success",
+                "warning": "File appears to be a scanned image. OCR may be required.",
+                "extracted_text": ""
+            })
+
+        # The AI resume check is started first so it runs while the (blocking)
+        # jailbreak scan is in flight; it is cancelled if the scan flags the file.
+        safety_text = parsers.redact_pii(text)
+        logger.info("🤖 Verifying document content with AI...")
+        validation_task = asyncio.create_task(ai_service.validate_is_resume(safety_text))
+
+        # --- SECURITY CHECK 3: Guardrail Jailbreak Detection ---
+        try:
+            is_attack, guard_usage = await asyncio.to_thread(GuardrailService.detect_jailbreak, text[:2000])
+        except BaseException:
+            validation_task.cancel()
+            raise
 
         if is_attack:
+            validation_task.cancel()
             safe_evidence = parsers.redact_pii(text[:2000])
             
             logger.warning(f"⛔ Jailbreak Detected in uploaded file: {file.filename}")
@@ -62,22 +107,7 @@ async def upload_resume(file: UploadFile = File(...)):
         if guard_usage:
             logger.info(f"💰 RESUME SCAN COST: {guard_usage['total_tokens']} tokens")
 
-        # --- LOGIC CHECK: Is it a scanned image? ---
-        if len(text.strip()) < 50:
-            logger.warning(f"⚠️ OCR Required: File {file.filename} contains almost no text.")
-            return {
-                "filename": file.filename, 
-                "status": "partial_success",
-                "warning": "File appears to be a scanned image. OCR may be required.",
-                "extracted_text": ""
-            }
-        
-        logger.info("🤖 Verifying document content with AI...")
-
-        safety_text = parsers.redact_pii(text)
-        
-        # Call the new function in ai_service
-        validation_result = await ai_service.validate_is_resume(safety_text)
+        validation_result = await validation_task
         
         if not validation_result.get("isValid", True):
             reason = validation_result.get("reason", "Unknown")
@@ -89,11 +119,13 @@ async def upload_resume(file: UploadFile = File(...)):
         
         logger.info("✅ AI confirmed document is a valid resume.")
         logger.info(f"✅ Text extraction successful. Length: {len(text)} chars")
-        return {
+        # Returned as a Response so FastAPI skips jsonable_encoder over the resume text
+        return ORJSONResponse({
             "filename": file.filename, 
             "status": "success",
-            "extracted_text": safety_text # Truncate for response
-        }
+            # Redaction tags can lengthen the text; keep it within the request schemas' cap
+            "extracted_text": safety_text[:settings.RESUME_MAX_CHARS]
+        })
 
     except HTTPException as he:
         # If we raised a specific HTTP error (like the AI rejection), 
@@ -106,59 +138,54 @@ async def upload_resume(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="File is corrupted or encrypted.")
 
 @router.post("/match_skills")
-async def match_skills(request: Request):
+async def match_skills(req: MatchRequest):
     """
     Comparing Resume vs DB Standards
     """
     logger.info("Received request for /match_skills")
-    # 1. Parse Input
-    data = await request.json()
-    resume_text = data.get("resume_text", "")
-    target_role = data.get("target_role", "Software Engineer")
+    # 1. Input (validated by MatchRequest)
+    resume_text = req.resume_text
+    target_role = req.target_role
 
     # 2. Define the Stream Generator
     async def generate_updates():
         try:
             logger.info(f"Starting skill match analysis for role: {target_role}")
             # === STEP 1: DB LOOKUP ===
-            yield json.dumps({
+            yield frame({
                 "type": "status", 
                 "step": 1, 
                 "message": f"Querying DB for '{target_role}'..."
-            }) + "\n"
+            })
             
-            # --- B. BUILD detailed_skills LIST (CRITICAL: DO THIS BEFORE COUNTING) ---
-            detailed_skills = database.get_match_skills_data(target_role)
-
-            # --- C. NOW WE CAN SAFELY COUNT ---
-            count = len(detailed_skills)
-            yield json.dumps({
+            # --- B. FETCH detailed_skills (serialised once per role, with its count) ---
+            # Warm roles come straight from the cache, no thread-pool hop
+            cached = database.peek_match_skills_json(target_role)
+            if cached is None:
+                cached = await database.run_in_db_pool(database.get_match_skills_json, target_role)
+            detailed_skills_json, count = cached
+
+            # --- C. REPORT THE COUNT ---
+            yield frame({
                 "type": "status", 
                 "step": 1, 
                 "message": f"✔ Found {count} core competencies."
-            }) + "\n"
+            })
 
             # === STEP 2: AI ANALYSIS ===
-            yield json.dumps({
-                "type": "status", 
-                "step": 2, 
-                "message": "Anonymizing data & Initializing AI Analyst..."
-            }) + "\n"
+            yield STATUS_ANONYMIZING
 
             clean_resume_text = parsers.redact_pii(resume_text[:5000])
 
-            # Simulate thinking steps for the UI trace
-            await asyncio.sleep(0.2)
-            yield json.dumps({"type": "status", "step": 2, "message": "Reading resume work history..."}) + "\n"
-            
-            await asyncio.sleep(0.2)
-            yield json.dumps({"type": "status", "step": 2, "message": "Mapping skills to gaps..."}) + "\n"
+            # Thinking steps for the UI trace (sent straight away; any pacing is the client's job)
+            yield STATUS_READING
+            yield STATUS_MAPPING
 
             inputs = {
                 "role": target_role,
                 "role_desc": f"Professional {target_role}",
-                "detailed_skills": json.dumps(detailed_skills, indent=2),
-                "resume_text": clean_resume_text[:5000]
+                "detailed_skills": detailed_skills_json,
+                "resume_text": clean_resume_text
             }
 
             logger.info("Sending prompt to AI...")
@@ -173,13 +200,9 @@ async def match_skills(request: Request):
             logger.info("AI Response received successfully.")
 
             # === STEP 3: FINALIZING ===
-            yield json.dumps({
-                "type": "status", 
-                "step": 3, 
-                "message": "Formatting final JSON report..."
-            }) + "\n"
+            yield STATUS_FORMATTING
             
-            analysis_result = parsers.parse_json_safely(ai_response_str)
+            analysis_result = await parsers.run_parser(parsers.parse_json_safely, ai_response_str)
             
             if not analysis_result:
                 logger.error("Failed to parse JSON from AI response.")
@@ -191,11 +214,11 @@ async def match_skills(request: Request):
 
             # --- SEND FINAL RESULT ---
             logger.info("Stream complete. Sending results.")
-            yield json.dumps({"type": "result", "data": analysis_result}) + "\n"
+            yield frame({"type": "result", "data": analysis_result})
 
         except Exception as e:
             logger.error(f"Stream Error in match_skills: {e}", exc_info=True)
-            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+            yield frame({"type": "error", "message": str(e)})
 
     # Return the stream
-    return StreamingResponse(generate_updates(), media_type="application/x-ndjson")
\ No newline at end of file
+    return StreamingResponse(buffered(generate_updates()), media_type="application/x-ndjson", headers=NDJSON_HEADERS)
\ No newline at end of file
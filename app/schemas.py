@@ -1,13 +1,21 @@
-from pydantic import BaseModel
-from typing import Optional, Dict
+from pydantic import BaseModel, StringConstraints
+from typing import Annotated, Optional, Dict
+
+from app.core.config import settings
+
+# Length caps are checked by pydantic-core before any handler code runs
+ResumeText = Annotated[str, StringConstraints(max_length=settings.RESUME_MAX_CHARS)]
+AnswerText = Annotated[str, StringConstraints(max_length=settings.ANSWER_MAX_CHARS)]
+RoleName = Annotated[str, StringConstraints(max_length=settings.ROLE_MAX_CHARS)]
+QuestionText = Annotated[str, StringConstraints(max_length=settings.QUESTION_MAX_CHARS)]
 
 class AnalyzeRequest(BaseModel):
-    student_answer: str
-    question: str
-    target_role: str
-    resume_text: str
+    student_answer: AnswerText
+    question: QuestionText
+    target_role: RoleName
+    resume_text: ResumeText
     skill_data: Optional[Dict] = None
 
 class MatchRequest(BaseModel):
-    resume_text: str
-    target_role: str
\ No newline at end of file
+    resume_text: ResumeText = ""
+    target_role: RoleName = "Software Engineer"
\ No newline at end of file
@@ -1,9 +1,12 @@
 import os
-import json
+import asyncio
 import re
 import random
 import time
 import yaml
+import hashlib
+import functools
+import orjson
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_groq import ChatGroq
@@ -13,6 +16,7 @@ from openai import AsyncOpenAI
 
 from app.core.config import settings, logger
 from app.utils import parsers
+from app.utils.cache import LRUCache
 from app.services.guardrails import GuardrailService
 
 # --- GLOBAL STATE ---
@@ -21,6 +25,21 @@ PROMPTS = {}
 gemini_llm = None
 openai_llm = None
 groq_llm = None
+_whisper_clients = {}
+
+# Exact-match cache of model answers. The models run at temperature 0, so an
+# identical (step, inputs) pair would get the same answer again.
+RESPONSE_CACHE_TTL = 3600  # seconds
+_response_cache = LRUCache(maxsize=512, ttl=RESPONSE_CACHE_TTL)
+
+# Tier 1 race losers left to finish so their token usage still gets logged;
+# held here so they aren't garbage-collected mid-flight
+_race_losers = set()
+
+def _race_loser_done(task):
+    _race_losers.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.info(f"Tier 1 race loser failed after the winner answered: {task.exception()}")
 
 def load_prompts():
     """Loads prompts from app/prompts.yaml"""
@@ -31,6 +50,9 @@ def load_prompts():
         try:
             with open(prompt_path, "r", encoding="utf-8") as f:
                 PROMPTS = yaml.safe_load(f)
+            # Cached templates/answers were built from the previous prompt texts
+            get_prompt.cache_clear()
+            _response_cache.clear()
             logger.info("✅ Prompts loaded from YAML.")
         except Exception as e:
             logger.error(f"❌ Failed to load prompts.yaml: {e}")
@@ -46,12 +68,36 @@ def load_star_guide():
     global STAR_GUIDE_TEXT
     
     if os.path.exists(settings.STAR_GUIDE_PATH):
+        cache_path = settings.STAR_GUIDE_CACHE_PATH
         try:
-            with open(settings.STAR_GUIDE_PATH, "rb") as f:
-                content = f.read()
-            # Use the new utility
-            STAR_GUIDE_TEXT = parsers.extract_text_from_pdf(content)
-            logger.info(f"✅ STAR Guide loaded successfully ({len(content)} chars).")
+            # Text extracted on an earlier boot, still newer than the PDF
+            if settings.STAR_GUIDE_TEXT_CACHE and os.path.exists(cache_path) \
+                    and os.path.getmtime(cache_path) >= os.path.getmtime(settings.STAR_GUIDE_PATH):
+                with open(cache_path, encoding="utf-8") as f:
+                    STAR_GUIDE_TEXT = f.read()
+                logger.info(f"✅ STAR Guide loaded from text cache ({len(STAR_GUIDE_TEXT)} chars).")
+                return
+
+            # pdftotext when the image has poppler; PyMuPDF (reading the file itself) otherwise
+            STAR_GUIDE_TEXT = (
+                parsers.extract_text_with_pdftotext(settings.STAR_GUIDE_PATH)
+                or parsers.extract_text_from_pdf(settings.STAR_GUIDE_PATH)
+            )
+            logger.info(f"✅ STAR Guide loaded successfully ({len(STAR_GUIDE_TEXT)} chars).")
+            if settings.STAR_GUIDE_TEXT_CACHE and STAR_GUIDE_TEXT:
+                # Write then rename, so a crash or a second worker booting at the same
+                # time can never leave a truncated cache that looks newer than the PDF
+                # (the temp name is per process so two writers don't share it)
+                tmp_path = f"{cache_path}.{os.getpid()}.part"
+                try:
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(STAR_GUIDE_TEXT)
+                    os.replace(tmp_path, cache_path)
+                except OSError as e:
+                    # Read-only filesystem etc.: next boot just parses the PDF again
+                    logger.warning(f"⚠️ Could not write STAR Guide text cache: {e}")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
         except Exception as e:
             logger.error(f"❌ Failed to load STAR Guide: {e}")
             STAR_GUIDE_TEXT = "Standard STAR Method principles." # Fallback
@@ -105,14 +151,21 @@ def init_ai_models():
             logger.info(f"✅ Groq Initialized successfully. Groq API: {mask_key(settings.GROQ_API_KEY)}")
         except Exception as e: logger.error(f"Groq Fail: {e}")
 
+@functools.lru_cache(maxsize=None)
 def get_prompt(prompt_name):
-    """Retrieves a prompt template from the loaded YAML."""
+    """
+    Retrieves a prompt template from the loaded YAML.
+    Parsed once per name; load_prompts() clears the cache when the YAML is reloaded.
+    """
     raw_text = PROMPTS.get(prompt_name, "")
     if not raw_text:
         logger.error(f"Prompt '{prompt_name}' not found!")
         return ChatPromptTemplate.from_template("Error: Prompt missing.")
     return ChatPromptTemplate.from_template(raw_text)
 
+# Compiled once; parse_llm_response runs on every agent reply
+_THINKING_RE = re.compile(r'<thinking>(.*?)</thinking>', re.DOTALL)
+
 def parse_llm_response(raw_text):
     """
     Extracts content inside <thinking> tags and separates it from the final answer.
@@ -122,12 +175,12 @@ def parse_llm_response(raw_text):
         return "No thinking.", "No response."
 
     # 1. Try to find the thinking block
-    thinking_match = re.search(r'<thinking>(.*?)</thinking>', raw_text, re.DOTALL)
+    thinking_match = _THINKING_RE.search(raw_text)
     
     if thinking_match:
         # Case A: Tags found
         thinking_content = thinking_match.group(1).strip()
-        final_answer = re.sub(r'<thinking>.*?</thinking>', '', raw_text, flags=re.DOTALL).strip()
+        final_answer = _THINKING_RE.sub('', raw_text).strip()
         
         # Safety: If final answer is empty but thinking exists, use thinking as the answer
         if not final_answer:
@@ -140,6 +193,34 @@ def parse_llm_response(raw_text):
         # If the AI didn't output tags, treat the WHOLE text as the final answer.
         return "No internal thought trace.", raw_text.strip()
 
+# Static "parachute" replies, encoded once: they never depend on the inputs
+_FALLBACK_SKILL_MATCHER = orjson.dumps({
+    "matched_skills": [
+        {
+            "skill": "General Professionalism",
+            "code": "GEN-PRO-001",
+            "reason": "Resume detected, but AI deep analysis is currently offline due to high server load."
+        }
+    ],
+    "missing_skills": [
+        {
+            "skill": "Technical Deep Dive (System Busy)",
+            "code": "ERR-503",
+            "gap": "Our AI analysis servers are currently experiencing very high traffic. Please manually review your specific technical requirements against the job description while we cool down."
+        }
+    ]
+}).decode()
+
+# A format that works for BOTH Manager and Coach parsing
+_FALLBACK_AGENT = orjson.dumps({
+    # Manager-style keys
+    "manager_critique": "⚠️ **System Notification:** High Server Load. We cannot provide specific technical feedback right now.",
+    
+    # Coach-style keys
+    "coach_critique": "Our AI Coach is currently assisting too many users (Capacity Limit Reached). However, a universal tip is to ensure your answer follows the STAR method strictly.",
+    "rewritten_answer": "**Situation:** [Your Context] **Task:** [Your Challenge] **Action:** [Specific Steps Taken] **Result:** [Quantifiable Outcome]. \n\n*(Please try again in 5 minutes for a specific rewrite).* "
+}).decode()
+
 def get_static_fallback(step_name: str, inputs: dict) -> str:
     """
     Returns a generic, safe response when all AI models fail.
@@ -149,34 +230,10 @@ def get_static_fallback(step_name: str, inputs: dict) -> str:
     
     # 1. Fallback for "Skill Matcher" (Gap Analysis)
     if step_name == "Skill Matcher":
-        return json.dumps({
-            "matched_skills": [
-                {
-                    "skill": "General Professionalism",
-                    "code": "GEN-PRO-001",
-                    "reason": "Resume detected, but AI deep analysis is currently offline due to high server load."
-                }
-            ],
-            "missing_skills": [
-                {
-                    "skill": "Technical Deep Dive (System Busy)",
-                    "code": "ERR-503",
-                    "gap": "Our AI analysis servers are currently experiencing very high traffic. Please manually review your specific technical requirements against the job description while we cool down."
-                }
-            ]
-        })
+        return _FALLBACK_SKILL_MATCHER
 
     # 2. Fallback for "Coach Agent" (Interview Coaching) or "Manager Agent"
-    else:
-        # We return a format that works for BOTH Manager and Coach parsing
-        return json.dumps({
-            # Manager-style keys
-            "manager_critique": "⚠️ **System Notification:** High Server Load. We cannot provide specific technical feedback right now.",
-            
-            # Coach-style keys
-            "coach_critique": "Our AI Coach is currently assisting too many users (Capacity Limit Reached). However, a universal tip is to ensure your answer follows the STAR method strictly.",
-            "rewritten_answer": "**Situation:** [Your Context] **Task:** [Your Challenge] **Action:** [Specific Steps Taken] **Result:** [Quantifiable Outcome]. \n\n*(Please try again in 5 minutes for a specific rewrite).* "
-        })
+    return _FALLBACK_AGENT
     
 async def validate_is_resume(text: str):
     """
@@ -211,12 +268,12 @@ async def validate_is_resume(text: str):
         # Default to True so we don't block users if the server crashes
         return {"isValid": True, "reason": "System Error"}
     
-async def run_chain_with_fallback(prompt_template, inputs, step_name="AI"):
+async def _check_input_guardrails(inputs, step_name):
     """
-    Strategy:
-    1. Tier 1: OpenAI & Gemini (Randomize order 50/50).
-    2. Tier 2: Groq (Only if BOTH Tier 1 models fail).
-    3. Tier 3: Static Fallback (If ALL AI fails).
+    Runs the input rails (jailbreak + toxicity) over the flattened inputs.
+    Returns the refusal message to send back, or None if the input is clean.
+    Both checks are blocking OpenAI calls, so they run side by side on worker
+    threads instead of one after the other on the event loop.
     """
     # =========================================================
     # 🛡️ PHASE 0: INPUT GUARDRAIL (The "Input Rail")
@@ -226,7 +283,10 @@ async def run_chain_with_fallback(prompt_template, inputs, step_name="AI"):
     # Flatten inputs to a string to scan for attacks
     scan_text = str(inputs)
 
-    is_jailbreak, guard_usage = GuardrailService.detect_jailbreak(scan_text)
+    (is_jailbreak, guard_usage), is_toxic = await asyncio.gather(
+        asyncio.to_thread(GuardrailService.detect_jailbreak, scan_text),
+        asyncio.to_thread(GuardrailService.check_toxicity, scan_text, source="Inbound"),
+    )
 
     if guard_usage:
         logger.info(
@@ -242,52 +302,16 @@ async def run_chain_with_fallback(prompt_template, inputs, step_name="AI"):
         return "I cannot process this request. I am programmed to be a helpful Interview Coach and cannot ignore my instructions."
 
     # 2. TOXICITY CHECK (Inbound Content Moderation)
-    if GuardrailService.check_toxicity(scan_text, source="Inbound"):
+    if is_toxic:
         logger.warning(f"🚫 SAFETY: Toxic input blocked in {step_name}")
         return "I cannot process this request as it contains content that violates our safety guidelines."
 
-    # =========================================================
-
-    # Helper to run and log tokens
-    async def execute_and_log(chain, model_name):
-        # --- 1. LOG INPUT (First 50 words) ---
-        # Convert inputs dict to string and flatten newlines for cleaner logs
-        input_flat = str(inputs).replace('\n', ' ')
-        input_preview = " ".join(input_flat.split()[:50])
-        logger.info(f"📤 [{model_name}] SENDING: {input_preview}...")
-
-        # Start Timer
-        start_time = time.time()
-
-        # --- 2. EXECUTE ---
-        response = await chain.ainvoke(inputs)
-        
-        # Stop Timer
-        duration = time.time() - start_time
-
-        # --- 3. LOG OUTPUT (First 50 words) ---
-        content = response.content
-        if content:
-            # Flatten newlines
-            content_flat = content.replace('\n', ' ')
-            output_preview = " ".join(content_flat.split()[:50])
-            logger.info(f"📥 [{model_name}] RECEIVED ({duration:.2f}s): {output_preview}...")
-        else:
-            logger.info(f"📥 [{model_name}] RECEIVED ({duration:.2f}s): [Empty Content]")
-
-        # --- 4. LOG TOKEN USAGE (Your existing code) ---
-        usage = response.usage_metadata
-        if usage:
-            input_tok = usage.get('input_tokens', 0)
-            output_tok = usage.get('output_tokens', 0)
-            total_tok = usage.get('total_tokens', 0)
-            logger.info(
-                f"💰 TOKEN USAGE ({step_name} - {model_name}): "
-                f"In={input_tok}, Out={output_tok}, Total={total_tok}"
-            )
-            
-        return response.content
+    return None
 
+def _build_execution_plan(prompt_template, step_name):
+    """
+    Returns (chains, execution_order): Tier 1 (Gemini/OpenAI) shuffled, then Groq.
+    """
     chains = {}
     
     # Only create the chain if the LLM actually exists
@@ -323,6 +347,82 @@ async def run_chain_with_fallback(prompt_template, inputs, step_name="AI"):
         execution_order.append("Groq")
     
     logger.info(f"🎲 Execution Plan for {step_name}: {execution_order}")
+    return chains, execution_order
+
+def _log_response(response, model_name, step_name, duration):
+    """Logs a preview of the model output and its token usage."""
+    # --- LOG OUTPUT (First 50 words) ---
+    content = response.content
+    if content:
+        # Flatten newlines
+        content_flat = content.replace('\n', ' ')
+        output_preview = " ".join(content_flat.split()[:50])
+        logger.info(f"📥 [{model_name}] RECEIVED ({duration:.2f}s): {output_preview}...")
+    else:
+        logger.info(f"📥 [{model_name}] RECEIVED ({duration:.2f}s): [Empty Content]")
+
+    # --- LOG TOKEN USAGE ---
+    usage = response.usage_metadata
+    if usage:
+        input_tok = usage.get('input_tokens', 0)
+        output_tok = usage.get('output_tokens', 0)
+        total_tok = usage.get('total_tokens', 0)
+        logger.info(
+            f"💰 TOKEN USAGE ({step_name} - {model_name}): "
+            f"In={input_tok}, Out={output_tok}, Total={total_tok}"
+        )
+
+def _log_request(inputs, model_name):
+    # Convert inputs dict to string and flatten newlines for cleaner logs
+    input_flat = str(inputs).replace('\n', ' ')
+    input_preview = " ".join(input_flat.split()[:50])
+    logger.info(f"📤 [{model_name}] SENDING: {input_preview}...")
+
+def _response_cache_key(step_name, inputs):
+    """16-byte digest of the step and its (sorted) inputs."""
+    payload = orjson.dumps([step_name, inputs], option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+async def run_chain_with_fallback(prompt_template, inputs, step_name="AI"):
+    """
+    Strategy:
+    1. Tier 1: OpenAI & Gemini, raced when settings.RACE_TIER1 is on (first
+       answer wins; the other call finishes in the background so its token
+       usage is still logged); otherwise in random order.
+    2. Tier 2: Groq (Only if BOTH Tier 1 models fail).
+    3. Tier 3: Static Fallback (If ALL AI fails).
+    Real model answers are cached; refusals and static fallbacks never are.
+    """
+    cache_key = _response_cache_key(step_name, inputs)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"♻️ Cache hit for {step_name}, skipping model call.")
+        return cached
+
+    refusal = await _check_input_guardrails(inputs, step_name)
+    if refusal:
+        return refusal
+
+    # Helper to run and log tokens
+    async def execute_and_log(chain, model_name):
+        # --- 1. LOG INPUT (First 50 words) ---
+        _log_request(inputs, model_name)
+
+        # Start Timer
+        start_time = time.time()
+
+        # --- 2. EXECUTE ---
+        response = await chain.ainvoke(inputs)
+        
+        # Stop Timer
+        duration = time.time() - start_time
+
+        # --- 3. LOG OUTPUT + TOKEN USAGE ---
+        _log_response(response, model_name, step_name, duration)
+            
+        return response.content
+
+    chains, execution_order = _build_execution_plan(prompt_template, step_name)
 
     # =========================================================
     # 3. EXECUTE WITH FAILOVER
@@ -332,14 +432,48 @@ async def run_chain_with_fallback(prompt_template, inputs, step_name="AI"):
         logger.critical(f"❌ No AI models available for {step_name}.")
         return get_static_fallback(step_name, inputs)
 
-    last_exception = None
-    
-    for model_name in execution_order:
+    remaining = execution_order
+    tier1 = [m for m in execution_order if m != "Groq"]
+
+    if settings.RACE_TIER1 and len(tier1) > 1:
+        logger.info(f"🏁 Racing {step_name} across {tier1}...")
+        tasks = {asyncio.create_task(execute_and_log(chains[m], m)): m for m in tier1}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                # Look at every finished task, so no exception goes unretrieved
+                for task in done:
+                    error = task.exception()
+                    if error is not None:
+                        logger.warning(f"⚠️ {tasks[task]} Failed: {error}. Failing over...")
+                    elif not task.result():
+                        # An empty answer loses to the other model (or Groq)
+                        logger.warning(f"⚠️ {tasks[task]} returned no content. Failing over...")
+                    elif winner is None:
+                        winner = task
+                if winner is not None:
+                    logger.info(f"🏆 {tasks[winner]} answered first for {step_name}.")
+                    content = winner.result()
+                    _response_cache.set(cache_key, content)
+                    return content
+        finally:
+            # The slower model's answer is not needed, but it is already billed:
+            # let it finish in the background so its TOKEN USAGE line is logged
+            for task in pending:
+                _race_losers.add(task)
+                task.add_done_callback(_race_loser_done)
+        remaining = [m for m in execution_order if m not in tier1]
+
+    for model_name in remaining:
         try:
             logger.info(f"🤖 Attempting {step_name} with {model_name}...")
-            return await execute_and_log(chains[model_name], model_name)
+            content = await execute_and_log(chains[model_name], model_name)
+            if content:
+                _response_cache.set(cache_key, content)
+            return content
         except Exception as e:
-            last_exception = e
             logger.warning(f"⚠️ {model_name} Failed: {e}. Failing over...")
 
     # =========================================================
@@ -348,9 +482,81 @@ async def run_chain_with_fallback(prompt_template, inputs, step_name="AI"):
     logger.critical(f"❌ ALL AI MODELS FAILED for {step_name}. Deploying Static Response.")
     return get_static_fallback(step_name, inputs)
 
+async def run_chain_with_fallback_stream(prompt_template, inputs, step_name="AI"):
+    """
+    Streaming version of run_chain_with_fallback: same guardrails and failover
+    order, but yields the text in chunks as the model produces it.
+    If a model fails after it has already streamed some text, None is yielded
+    before the next model starts, so the caller can throw away the partial answer.
+    """
+    cache_key = _response_cache_key(step_name, inputs)
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"♻️ Cache hit for {step_name}, skipping model call.")
+        yield cached
+        return
+
+    refusal = await _check_input_guardrails(inputs, step_name)
+    if refusal:
+        yield refusal
+        return
+
+    chains, execution_order = _build_execution_plan(prompt_template, step_name)
+
+    if not execution_order:
+        # Case: ALL keys are missing (or app config is broken)
+        logger.critical(f"❌ No AI models available for {step_name}.")
+        yield get_static_fallback(step_name, inputs)
+        return
+
+    for model_name in execution_order:
+        streamed = False
+        try:
+            logger.info(f"🤖 Attempting {step_name} with {model_name} (streaming)...")
+            _log_request(inputs, model_name)
+            start_time = time.time()
+
+            # Chunks add up into one message, so logging sees the full text + usage
+            response = None
+            async for chunk in chains[model_name].astream(inputs):
+                response = chunk if response is None else response + chunk
+                if chunk.content:
+                    streamed = True
+                    yield chunk.content
+
+            if response is not None:
+                _log_response(response, model_name, step_name, time.time() - start_time)
+                if response.content:
+                    _response_cache.set(cache_key, response.content)
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ {model_name} Failed: {e}. Failing over...")
+            if streamed:
+                yield None
+
+    logger.critical(f"❌ ALL AI MODELS FAILED for {step_name}. Deploying Static Response.")
+    yield get_static_fallback(step_name, inputs)
+
+def _get_whisper_client(name):
+    """
+    Returns the shared AsyncOpenAI client for a transcription provider.
+    Built on first use and reused, so each request keeps the warm HTTP pool.
+    """
+    client = _whisper_clients.get(name)
+    if client is None:
+        if name == "OpenAI":
+            client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        else:
+            client = AsyncOpenAI(
+                api_key=settings.GROQ_API_KEY, 
+                base_url="https://api.groq.com/openai/v1"
+            )
+        _whisper_clients[name] = client
+    return client
+
 async def _transcribe_openai(file_obj):
     """Try OpenAI Whisper-1"""
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    client = _get_whisper_client("OpenAI")
     return await client.audio.transcriptions.create(
         model="whisper-1", 
         file=(file_obj.filename, file_obj.file)
@@ -358,10 +564,7 @@ async def _transcribe_openai(file_obj):
 
 async def _transcribe_groq(file_obj):
     """Try Groq Whisper-Large (Fast!)"""
-    client = AsyncOpenAI(
-        api_key=settings.GROQ_API_KEY, 
-        base_url="https://api.groq.com/openai/v1"
-    )
+    client = _get_whisper_client("Groq")
     return await client.audio.transcriptions.create(
         model="whisper-large-v3", 
         file=(file_obj.filename, file_obj.file)
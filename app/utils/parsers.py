@@ -1,46 +1,105 @@
 import re
 import json
+import asyncio
 import logging
-import io
-from pypdf import PdfReader
+import shutil
+import subprocess
+import orjson
+import fitz  # PyMuPDF
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(file_content: bytes) -> str:
+# Compiled once at import; these run on every AI response
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+def _loads(json_str: str):
+    """
+    orjson first (several times faster); stdlib json for the few inputs orjson
+    rejects but json accepts, such as NaN/Infinity literals. Raises JSONDecodeError
+    if neither can parse it.
+    """
+    try:
+        return orjson.loads(json_str)
+    except orjson.JSONDecodeError:
+        return json.loads(json_str)
+
+# Below this many characters parsing costs less than a thread hand-off
+OFFLOAD_THRESHOLD = 8192
+
+async def run_parser(func, text, *args):
+    """
+    Calls a text parser from async code. Large inputs run on a worker thread so
+    regex/JSON work on a long model reply can't stall other streams; short ones
+    are parsed inline.
+    """
+    if text and len(text) > OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(func, text, *args)
+    return func(text, *args)
+
+def extract_text_from_pdf(file_content, max_chars: int = None) -> str:
     """
-    Reads bytes and returns clean text.
+    Reads PDF bytes (or a file path) and returns clean text (PyMuPDF: C-level parsing, far faster than pure-Python readers).
     Safeguard: Adds newlines to prevent text merging (crucial for Regex).
+    If max_chars is given, stops extracting pages once that much text is collected
+    and truncates the result to it.
+    A path is opened by PyMuPDF directly, without reading the file into memory first.
     """
     try:
-        reader = PdfReader(io.BytesIO(file_content))
         text_parts = []
-        
-        for page in reader.pages:
-            # extraction_mode="layout" (if using newer pypdf) helps, 
-            # but adding "\n" manually is the safest fallback for all versions.
-            page_text = page.extract_text()
-            if page_text:
-                text_parts.append(page_text)
+        collected = 0
+
+        if isinstance(file_content, str):
+            doc = fitz.open(file_content)
+        else:
+            doc = fitz.open(stream=file_content, filetype="pdf")
+
+        with doc:
+            for page in doc:
+                page_text = page.get_text("text")
+                if page_text:
+                    text_parts.append(page_text)
+                    collected += len(page_text) + 2
+                    # Later pages would only be cut off again
+                    if max_chars is not None and collected >= max_chars:
+                        break
         
         # Join with double newlines to separate sections clearly
         full_text = "\n\n".join(text_parts)
         
-        return full_text.strip()
+        return full_text.strip()[:max_chars]
 
     except Exception as e:
         logger.error(f"❌ PDF Parse Error: {e}")
         return ""
 
+def extract_text_with_pdftotext(path: str) -> str:
+    """
+    Extracts a PDF on disk with poppler's `pdftotext` CLI, which is faster again
+    than PyMuPDF on large documents. Returns "" when the binary isn't installed
+    or fails, so callers can fall back to extract_text_from_pdf.
+    """
+    exe = shutil.which("pdftotext")
+    if not exe:
+        return ""
+    try:
+        result = subprocess.run(
+            [exe, "-q", "-nopgbrk", path, "-"],
+            capture_output=True, check=True, timeout=10
+        )
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning(f"⚠️ pdftotext failed, falling back to PyMuPDF: {e}")
+        return ""
+    return result.stdout.decode("utf-8", errors="replace").strip()
+
 def extract_clean_json(text: str) -> dict:
-    logger.debug("Raw AI text received for parsing.")
     """
-    Strips '```json' formatting and finds the actual JSON object { ... }
+    Finds the actual JSON object { ... } in an AI reply, ignoring any '```json'
+    fences or chatter around it.
     """
+    logger.debug("Raw AI text received for parsing.")
     try:
-        # 1. Remove Markdown code blocks
-        text = re.sub(r"```json|```", "", text, flags=re.IGNORECASE).strip()
-        
-        # 2. Find the content between the first '{' and the last '}'
+        # 1. Find the content between the first '{' and the last '}'
+        # (markdown fences sit outside that span, so they need no stripping)
         start_idx = text.find("{")
         end_idx = text.rfind("}")
         
@@ -50,15 +109,36 @@ def extract_clean_json(text: str) -> dict:
             
         json_str = text[start_idx : end_idx + 1]
         
-        # 3. Parse and return
+        # 2. Parse and return
+        result = _loads(json_str)
         logger.info("JSON parsed successfully.")
-        return json.loads(json_str)
+        return result
         
     except json.JSONDecodeError as e:
         logger.error(f"JSON Parsing Failed: {e}", exc_info=True)
         logger.error(f"Bad JSON String: {json_str[:500]}...")
         return None
 
+# --- redact_pii patterns, compiled once at import (the function runs per upload/match) ---
+_NRIC_RE = re.compile(r'\b[S|T|F|G]\d{7}[A-Z]\b', re.IGNORECASE)
+_EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+_LINK_RE = re.compile(r'(?:https?://)?(?:www\.)?(?:linkedin\.com|github\.com)/[\w\-\./]+', re.IGNORECASE)
+_INTL_PHONE_RE = re.compile(r'(?:\+|00)\d{1,3}[-. ]?\(?\d{1,4}\)?[-. ]?\d{3,}[-. ]?\d{3,}')
+_US_PHONE_RE = re.compile(r'(?:\(\d{3}\)|\d{3})[-. ]\d{3}[-. ]\d{4}')
+_SG_PHONE_RE = re.compile(r'\b[689]\d{3}[- ]?\d{4}\b')
+_POSTAL_RE = re.compile(r'(?i)(Singapore|S\(?)\s*\d{6}\)?')
+_POSTAL_BARE_RE = re.compile(r'\b\d{6}\b')
+_UNIT_RE = re.compile(r'#\d{1,4}-\d{1,5}')
+_BLOCK_RE = re.compile(r'\b(Blk|Block)\s*\d+[A-Za-z]?\b', re.IGNORECASE)
+_NAME_LABEL_RE = re.compile(r'(?i)(Name|Candidate):\s*([A-Z][a-z]+ [A-Z][a-z]+)')
+_CREDIT_CARD_RE = re.compile(r'\b(?:\d[ -]*?){13,19}\b')
+_UEN_RE = re.compile(r'\b\d{9,10}[A-Za-z]\b')
+_DEMOGRAPHICS_RE = re.compile(r'(?i)(Race|Religion|Nationality|Marital Status|Gender)\s*[:\-]\s*\w+')
+_DOB_RE = re.compile(r'(?i)(Date of Birth|DOB|Born)\s*[:\-]?\s*.*?(?=\n|$)')
+_BANK_ACCT_RE = re.compile(r'(?i)(Account|A/C|Acc|POSB|DBS|OCBC|UOB|UB)\W*[:\.]?\W*(\d[\d\s-]{6,15})')
+_CURRENCY_RE = re.compile(r'(?i)(SGD|S\$|\$)\s?[\d,]+(?:\.\d{2})?')
+_NAME_HEADER_RE = re.compile(r'^[A-Za-z \.]+$')
+
 def redact_pii(text: str) -> str:
     """
     Aggressively removes PII (Email, Phone, Address, Name) 
@@ -68,84 +148,75 @@ def redact_pii(text: str) -> str:
 
     # --- 1. SENSITIVE IDs (Singapore NRIC/FIN) ---
     # Matches: S1234567A, T1234567Z, F1234567N, G1234567X (Case insensitive)
-    text = re.sub(r'\b[S|T|F|G]\d{7}[A-Z]\b', '[NRIC_REDACTED]', text, flags=re.IGNORECASE)
+    text = _NRIC_RE.sub('[NRIC_REDACTED]', text)
 
     # --- 2. EMAILS & LINKS ---
-    text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[EMAIL_REDACTED]', text)
+    text = _EMAIL_RE.sub('[EMAIL_REDACTED]', text)
     # Remove LinkedIn/GitHub URLs (which often contain names)
-    link_pattern = r'(?:https?://)?(?:www\.)?(?:linkedin\.com|github\.com)/[\w\-\./]+'
-    text = re.sub(link_pattern, '[LINK_REDACTED]', text, flags=re.IGNORECASE)
+    text = _LINK_RE.sub('[LINK_REDACTED]', text)
 
     # --- 3. TELEPHONE NUMBERS (Robust Global & SG) ---
     
     # A. International Format (Starts with + or 00)
     # Examples: +1-202-555-0123 | +44 (0) 20 1234 5678 | +65 9123 4567
     # Logic: Look for +, then 1-3 digit country code, then groupings of digits/spaces/dashes
-    intl_phone_pattern = r'(?:\+|00)\d{1,3}[-. ]?\(?\d{1,4}\)?[-. ]?\d{3,}[-. ]?\d{3,}'
-    text = re.sub(intl_phone_pattern, '[PHONE_REDACTED]', text)
+    text = _INTL_PHONE_RE.sub('[PHONE_REDACTED]', text)
 
     # B. Standard US/Intl Format (No + sign, but uses parens or dashes)
     # Examples: (555) 123-4567 | 555-123-4567
     # We strictly look for parenthesis OR double dashes to avoid redacting dates like 2020-2024
-    us_phone_pattern = r'(?:\(\d{3}\)|\d{3})[-. ]\d{3}[-. ]\d{4}'
-    text = re.sub(us_phone_pattern, '[PHONE_REDACTED]', text)
+    text = _US_PHONE_RE.sub('[PHONE_REDACTED]', text)
 
     # C. Singapore Local Format (Specific)
     # Matches: 91234567, 8123 4567, 6123-4567 (Starts with 6, 8, or 9)
-    sg_phone_pattern = r'\b[689]\d{3}[- ]?\d{4}\b'
-    text = re.sub(sg_phone_pattern, '[PHONE_REDACTED]', text)
+    text = _SG_PHONE_RE.sub('[PHONE_REDACTED]', text)
 
     # --- 4. SINGAPORE ADDRESSES ---
     # A. Postal Codes (6 digits, boundary check to avoid matching random large numbers)
     # Often preceded by "Singapore" or "S("
-    text = re.sub(r'(?i)(Singapore|S\(?)\s*\d{6}\)?', '[POSTAL_CODE]', text)
+    text = _POSTAL_RE.sub('[POSTAL_CODE]', text)
     # Fallback: strict 6 digits at word boundary
-    text = re.sub(r'\b\d{6}\b', '[POSTAL_CODE]', text)
+    text = _POSTAL_BARE_RE.sub('[POSTAL_CODE]', text)
 
     # B. Unit Numbers (e.g., #04-123)
-    text = re.sub(r'#\d{1,4}-\d{1,5}', '[UNIT_NO]', text)
+    text = _UNIT_RE.sub('[UNIT_NO]', text)
     
     # C. Block Numbers
-    text = re.sub(r'\b(Blk|Block)\s*\d+[A-Za-z]?\b', '[BLOCK_NO]', text, flags=re.IGNORECASE)
+    text = _BLOCK_RE.sub('[BLOCK_NO]', text)
 
     # --- 5. NAMES (Heuristic) ---
     # A. Explicit labels
-    text = re.sub(r'(?i)(Name|Candidate):\s*([A-Z][a-z]+ [A-Z][a-z]+)', r'\1: [NAME_REDACTED]', text)
+    text = _NAME_LABEL_RE.sub(r'\1: [NAME_REDACTED]', text)
 
     # --- 6. FINANCIAL DATA (Credit Cards) ---
     # Matches 13-19 digits, with optional dashes or spaces
     # Examples: 4111 1234 5678 9010 | 4111-1234-5678-9010
-    cc_pattern = r'\b(?:\d[ -]*?){13,19}\b'
-    text = re.sub(cc_pattern, '[CREDIT_CARD_REDACTED]', text)
+    text = _CREDIT_CARD_RE.sub('[CREDIT_CARD_REDACTED]', text)
 
     # --- 7. SINGAPORE UEN (Company Reg No) ---
     # Invoices often have UENs (e.g., 200812345M). 
     # We redact this to genericize company data.
-    text = re.sub(r'\b\d{9,10}[A-Za-z]\b', '[UEN_REDACTED]', text)
+    text = _UEN_RE.sub('[UEN_REDACTED]', text)
 
     # --- 8. DEMOGRAPHICS (Anti-Bias) --- (NEW) ⚖️
     # Removes Race, Religion, Nationality, Marital Status
     # Matches: "Race: Chinese", "Nationality: Singaporean"
-    demographics_pattern = r'(?i)(Race|Religion|Nationality|Marital Status|Gender)\s*[:\-]\s*\w+'
-    text = re.sub(demographics_pattern, '[DEMOGRAPHIC_REDACTED]', text)
+    text = _DEMOGRAPHICS_RE.sub('[DEMOGRAPHIC_REDACTED]', text)
 
     # --- 9. DATE OF BIRTH --- (NEW) 🎂
     # Matches: "DOB: 01/01/1990", "Date of Birth: 12 Dec 1990"
-    dob_pattern = r'(?i)(Date of Birth|DOB|Born)\s*[:\-]?\s*.*?(?=\n|$)'
-    text = re.sub(dob_pattern, '[DOB_REDACTED]', text)
+    text = _DOB_RE.sub('[DOB_REDACTED]', text)
 
     # --- 10. BANK ACCOUNT NUMBERS (Context-Aware) ---
     # Looks for keywords like "Account No", "A/C", "POSB", "DBS", "OCBC", "UOB"
     # Followed by 7-15 digits (with optional dashes/spaces)
-    bank_acct_pattern = r'(?i)(Account|A/C|Acc|POSB|DBS|OCBC|UOB|UB)\W*[:\.]?\W*(\d[\d\s-]{6,15})'
     # We replace the number part (group 2) while keeping the label for context
-    text = re.sub(bank_acct_pattern, r'\1 [BANK_ACCT_REDACTED]', text)
+    text = _BANK_ACCT_RE.sub(r'\1 [BANK_ACCT_REDACTED]', text)
 
     # --- 11. CURRENCY & SALARY ---
     # Matches: $5000, $ 1,234.50, SGD 500, S$5000
     # Logic: Symbol/Code + optional space + digits + optional commas/decimals
-    currency_pattern = r'(?i)(SGD|S\$|\$)\s?[\d,]+(?:\.\d{2})?'
-    text = re.sub(currency_pattern, '[MONEY_REDACTED]', text)
+    text = _CURRENCY_RE.sub('[MONEY_REDACTED]', text)
 
     # B. The "Header" Assumption:
     # On most resumes, the first non-empty line is the Name. 
@@ -155,7 +226,7 @@ def redact_pii(text: str) -> str:
         line = lines[i].strip()
         if line:
             # If line is short and looks like a name (mostly letters, no weird symbols)
-            if len(line) < 30 and re.match(r'^[A-Za-z \.]+$', line):
+            if len(line) < 30 and _NAME_HEADER_RE.match(line):
                  lines[i] = "[NAME_REDACTED_HEADER]"
             break # Only try to redact the first valid line
             
@@ -186,10 +257,10 @@ def parse_json_safely(text: str) -> dict:
 
     # --- 2. Try to find JSON content using Regex ---
     try:
-        match = re.search(r"\{.*\}", text, re.DOTALL)
+        match = _JSON_OBJECT_RE.search(text)
         if match:
             json_str = match.group(0)
-            return json.loads(json_str)
+            return _loads(json_str)
     except Exception:
         pass
 
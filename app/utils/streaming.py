@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Sent when a stream has been quiet for KEEPALIVE_SECONDS, so proxies with an
+# idle timeout don't cut the connection during a long LLM call
+PING_FRAME = b'{"type":"ping"}\n'
+KEEPALIVE_SECONDS = 15
+
+# No proxy buffering (nginx honours X-Accel-Buffering) and no caching of a live stream
+NDJSON_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def frame(obj) -> bytes:
+    """
+    Encodes one NDJSON event as bytes, ready to yield from a StreamingResponse.
+    orjson returns bytes directly, so no str -> bytes encode step is needed.
+    """
+    return orjson.dumps(obj) + b"\n"
+
+
+def drain(buf: bytearray) -> bytes:
+    """
+    Returns the frames accumulated in `buf` as one body chunk and empties it,
+    so several back-to-back events go out in a single write.
+    """
+    data = bytes(buf)
+    buf.clear()
+    return data
+
+
+async def buffered(source, maxsize: int = 16, keepalive: float = KEEPALIVE_SECONDS):
+    """
+    Re-yields the frames of async generator `source`, but drives it from a
+    separate producer task through a bounded queue. The LLM/DB work behind the
+    next frames keeps going while the server is still writing earlier ones to
+    the socket; `maxsize` caps how far ahead the producer can get.
+    If nothing arrives for `keepalive` seconds a PING_FRAME is yielded instead;
+    `source` must yield whole frames so a ping can never land mid-line.
+    If the producer dies (any exception, including cancellation) the stream
+    ends with an error frame rather than pinging forever.
+    """
+    queue = asyncio.Queue(maxsize)
+
+    async def produce():
+        async for item in source:
+            await queue.put(item)
+
+    producer = asyncio.create_task(produce())
+    getter = None
+    try:
+        while True:
+            if getter is not None and getter.done():
+                item, getter = getter.result(), None
+                yield item
+                continue
+            # Frames already queued are taken without creating a task
+            if not queue.empty():
+                yield queue.get_nowait()
+                continue
+            if producer.done():
+                break
+            # Queue is empty: wait for the next frame, the producer ending, or the keepalive
+            if getter is None:
+                getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                (getter, producer), timeout=keepalive, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                yield PING_FRAME
+
+        # Everything the producer queued has been sent; report how it ended
+        error = "cancelled" if producer.cancelled() else producer.exception()
+        if error is not None:
+            logger.error(f"Stream producer failed: {error!r}")
+            yield frame({"type": "error", "message": "Stream interrupted, please try again."})
+    finally:
+        # Client went away (or we finished): stop the producer and its generator
+        if getter is not None:
+            getter.cancel()
+        producer.cancel()